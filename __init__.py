@@ -11,12 +11,29 @@ __all__ = ['register']
 def register():
     Pool.register(
         account.PartyBalanceAccount,
+        account.PartyBalanceSnapshot,
+        account.PartyBalanceChange,
         account.PartyBalanceAccountContext,
         account.PartyBalanceLine,
         account.Line,
+        account.Move,
+        account.Reconciliation,
+        account.Invoice,
+        account.Account,
+        account.AccountType,
+        account.PartyBalanceCurrent,
+        account.Cron,
+        account.RebuildOriginLabelStart,
+        account.StatementBatch,
+        account.StatementBatchParty,
         module='current_account', type_='model')
+    Pool.register(
+        account.Voucher,
+        module='current_account', type_='model',
+        depends=['account_voucher_ar'])
     Pool.register(
         account.OpenStatementOfAccount,
+        account.RebuildOriginLabel,
         module='current_account', type_='wizard')
     Pool.register(
         account.StatementOfAccountReport,
@@ -24,4 +41,7 @@ def register():
         account.PartyBalanceAccountReport,
         account.PartyBalanceLineReport,
         account.PartyBalanceLineSpreadsheet,
+        account.StatementOfAccountCSV,
+        account.PartyBalanceAccountCSV,
+        account.PartyBalanceLineCSV,
         module='current_account', type_='report')
@@ -2,19 +2,170 @@
 # This file is part of the current_account module for Tryton.
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
+import csv
+import datetime
+import tempfile
+from collections import defaultdict, namedtuple
 from decimal import Decimal
-from sql import Column, Literal, Null
-from sql.aggregate import Sum, Window
-from sql.conditionals import Coalesce
-
-from trytond.model import fields, ModelSQL, ModelView
-from trytond.wizard import Wizard, StateAction
+from types import MappingProxyType
+
+from sql import Column, Literal, Null, NullsFirst, Union
+from sql.aggregate import Count, Max, Min, Sum, Window
+from sql.conditionals import Case, Coalesce
+from sql.functions import CharLength, CurrentTimestamp
+
+from trytond import backend
+from trytond.cache import Cache
+from trytond.i18n import gettext
+from trytond.model import (
+    fields, dualmethod, Index, Model, ModelSQL, ModelView, Workflow)
+from trytond.model.exceptions import AccessError
+from trytond.wizard import (
+    Wizard, StateAction, StateTransition, StateView, Button)
 from trytond.report import Report
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import PYSONEncoder, Eval, If
-from trytond.transaction import Transaction
+from trytond.rpc import RPC
+from trytond.transaction import Transaction, without_check_access
 from trytond.tools import reduce_ids, grouped_slice
+from trytond.tools.domain_inversion import eval_domain
 from trytond.modules.company import CompanyReport
+from trytond.modules.currency.fields import Monetary
+
+
+_INVOICE_NAMES = {
+    # AFIP voucher codes of supplier invoices
+    'in': {
+        '001': 'FC A',
+        '002': 'ND A',
+        '003': 'NC A',
+        '004': 'RC A',
+        '005': 'NV A',
+        '006': 'FC B',
+        '007': 'ND B',
+        '008': 'NC B',
+        '009': 'RC B',
+        '010': 'NV B',
+        '011': 'FC C',
+        '012': 'ND C',
+        '013': 'NC C',
+        '015': 'RC C',
+        '016': 'NV C',
+        '017': 'LQ A',
+        '018': 'LQ B',
+        '019': 'FC EXT',
+        '020': 'ND EXT',
+        '021': 'NC EXT',
+        '037': 'ND RG1415',
+        '038': 'NC RG1415',
+        '051': 'FC M',
+        '052': 'ND M',
+        '053': 'NC M',
+        '054': 'RC M',
+        '055': 'NV M',
+        '063': 'LQ A',
+        '064': 'LQ B',
+        '066': 'D IMP',
+        '068': 'LQ C',
+        '081': 'TF A',
+        '082': 'TF B',
+        '083': 'T',
+        '089': 'RD',
+        '091': 'RM R',
+        '110': 'TNC',
+        '111': 'TF C',
+        '112': 'TNC A',
+        '113': 'TNC B',
+        '114': 'TNC C',
+        '115': 'TND A',
+        '116': 'TND B',
+        '117': 'TND C',
+        '118': 'TF M',
+        '119': 'TNC M',
+        '120': 'TND M',
+        },
+    # AFIP voucher codes of customer invoices
+    'out': {
+        '1': 'FC A',
+        '2': 'ND A',
+        '3': 'NC A',
+        '4': 'RC A',
+        '5': 'NV A',
+        '6': 'FC B',
+        '7': 'ND B',
+        '8': 'NC B',
+        '9': 'RC B',
+        '10': 'NV B',
+        '11': 'FC C',
+        '12': 'ND C',
+        '13': 'NC C',
+        '15': 'RC C',
+        '16': 'NV C',
+        '19': 'FC E',
+        '20': 'ND E',
+        '21': 'NC E',
+        '201': 'FCE A',
+        '202': 'NDE A',
+        '203': 'NCE A',
+        '206': 'FCE B',
+        '207': 'NDE B',
+        '208': 'NCE B',
+        '211': 'FCE C',
+        '212': 'NDE C',
+        '213': 'NCE C',
+        },
+    }
+INVOICE_NAMES = MappingProxyType({
+        type_: MappingProxyType(names)
+        for type_, names in _INVOICE_NAMES.items()})
+_selection_labels = Cache(
+    'current_account.selection_labels', context=False)
+# The hits and misses are reported by the statistics of the caches
+_party_agings = Cache('party.balance.account.aging', context=False,
+    duration=datetime.timedelta(hours=1))
+CompanyCurrency = namedtuple('CompanyCurrency', ['digits', 'exponent'])
+
+
+def _to_decimal(value):
+    "Return the SQL sum as Decimal as SQLite uses float"
+    if value is None:
+        return Decimal('0.0')
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value
+
+
+def company_currency(company_id):
+    '''
+    Return the digits and the quantization exponent of the company currency.
+    The values are kept in the cache of the transaction.
+    '''
+    currencies = Transaction().get_cache().setdefault(
+        'current_account.company_currency', {})
+    if company_id not in currencies:
+        Company = Pool().get('company.company')
+        if company_id is not None:
+            digits = Company(company_id).currency.digits
+        else:
+            digits = 2
+        currencies[company_id] = CompanyCurrency(
+            digits, Decimal(1).scaleb(-digits))
+    return currencies[company_id]
+
+
+def _category_parties(column, category_id):
+    "Return the condition of the column being a party of the category tree"
+    pool = Pool()
+    Category = pool.get('party.category')
+    PartyCategory = pool.get('party.party-party.category')
+    party_category = PartyCategory.__table__()
+    # Sub-queries keep the query size independent of the members
+    categories = Category.search([
+            ('parent', 'child_of', [category_id]),
+            ], order=[], query=True)
+    return column.in_(party_category.select(
+            party_category.party,
+            where=party_category.category.in_(categories)))
 
 
 class OriginTextMixin:
@@ -23,117 +174,124 @@ class OriginTextMixin:
     @classmethod
     def get_origin_text(cls, lines, name):
         result = {}
+        to_compute = []
+        for line in lines:
+            if line.origin_label is not None:
+                result[line.id] = line.origin_label
+            else:
+                to_compute.append(line)
+        result.update(cls._get_origin_texts(to_compute))
+        return result
+
+    @classmethod
+    def search_origin_text(cls, name, clause):
+        _, operator, value = clause[:3]
+        # The lines without label, like those of the draft moves, are matched
+        # on their computed text
+        lines = cls.search([('origin_label', '=', None)], order=[])
+        ids = [i for i, text in cls._get_origin_texts(lines).items()
+            if eval_domain([('text', operator, value)], {'text': text})]
+        return ['OR',
+            [('origin_label',) + tuple(clause[1:])],
+            [('id', 'in', ids)],
+            ]
+
+    @classmethod
+    def order_origin_text(cls, tables):
+        table, _ = tables[None]
+        return [table.origin_label]
+
+    @classmethod
+    def _get_origin_texts(cls, lines):
+        "Compute the origin text of the lines from their move origin"
+        pool = Pool()
+        result = {}
+        line_origins = {}
+        model_ids = defaultdict(set)
         for line in lines:
-            reference = ''
-            document = line.move_origin
-            origin = str(document)
-            if not origin.endswith('-1'):
-                model = origin[:origin.find(',')]
-                if model == 'account.invoice':
-                    reference = cls._get_invoice_text(document)
-                elif model == 'account.voucher':
-                    reference = cls._get_voucher_text(document)
-                elif model == 'account.move':
-                    reference = 'Asiento %s' % str(document.number)
-                elif model == 'account.statement':
-                    reference = 'Extracto %s' % str(document.rec_name)
-            result[line.id] = reference
+            result[line.id] = ''
+            origin = cls._get_line_origin(line)
+            if origin:
+                line_origins[line.id] = (origin.__name__, origin.id)
+                model_ids[origin.__name__].add(origin.id)
+
+        # Browse the origins of each model together to read them in batch
+        references = {}
+        for model, ids in model_ids.items():
+            Origin = pool.get(model)
+            for document in Origin.browse(list(ids)):
+                references[(model, document.id)] = (
+                    cls._get_origin_reference(document))
+
+        for line_id, origin in line_origins.items():
+            result[line_id] = references[origin]
         return result
 
+    @classmethod
+    def _get_line_origin(cls, line):
+        "Return the origin instance of the move of the line"
+        origin = line.move.origin if line.move else None
+        if (isinstance(origin, Model)
+                and origin.id is not None and origin.id >= 0):
+            return origin
+        return None
+
+    @classmethod
+    def _get_origin_reference(cls, document):
+        model = document.__name__
+        reference = ''
+        if model == 'account.invoice':
+            reference = cls._get_invoice_text(document)
+        elif model == 'account.voucher':
+            reference = cls._get_voucher_text(document)
+        elif model == 'account.move':
+            reference = 'Asiento %s' % str(document.number)
+        elif model == 'account.statement':
+            reference = 'Extracto %s' % str(document.rec_name)
+        return reference
+
+    @classmethod
+    def _get_invoice_names(cls, type_):
+        '''
+        Return the abbreviations of the AFIP voucher codes.
+        type_ is 'in' for the supplier codes and 'out' for the customer codes.
+        The modules adding codes extend it on account.move.line.
+        '''
+        return INVOICE_NAMES[type_]
+
     @classmethod
     def _get_invoice_text(cls, invoice):
         if invoice.type == 'in':
-            invoice_names = {
-                '001': 'FC A',
-                '002': 'ND A',
-                '003': 'NC A',
-                '004': 'RC A',
-                '005': 'NV A',
-                '006': 'FC B',
-                '007': 'ND B',
-                '008': 'NC B',
-                '009': 'RC B',
-                '010': 'NV B',
-                '011': 'FC C',
-                '012': 'ND C',
-                '013': 'NC C',
-                '015': 'RC C',
-                '016': 'NV C',
-                '017': 'LQ A',
-                '018': 'LQ B',
-                '019': 'FC EXT',
-                '020': 'ND EXT',
-                '021': 'NC EXT',
-                '037': 'ND RG1415',
-                '038': 'NC RG1415',
-                '051': 'FC M',
-                '052': 'ND M',
-                '053': 'NC M',
-                '054': 'RC M',
-                '055': 'NV M',
-                '063': 'LQ A',
-                '064': 'LQ B',
-                '066': 'D IMP',
-                '068': 'LQ C',
-                '081': 'TF A',
-                '082': 'TF B',
-                '083': 'T',
-                '089': 'RD',
-                '091': 'RM R',
-                '110': 'TNC',
-                '111': 'TF C',
-                '112': 'TNC A',
-                '113': 'TNC B',
-                '114': 'TNC C',
-                '115': 'TND A',
-                '116': 'TND B',
-                '117': 'TND C',
-                '118': 'TF M',
-                '119': 'TNC M',
-                '120': 'TND M',
-                }
-            if invoice.tipo_comprobante in invoice_names:
-                invoice_name = invoice_names[invoice.tipo_comprobante]
-            else:
-                invoice_name = invoice.tipo_comprobante_string or 'FC'
+            code = invoice.tipo_comprobante
+            invoice_name = (cls._get_invoice_names('in').get(code)
+                or cls._get_selection_labels(
+                    invoice.__name__, 'tipo_comprobante').get(code)
+                or 'FC')
             invoice_number = invoice.reference or ''
         else:
-            invoice_names = {
-                '1': 'FC A',
-                '2': 'ND A',
-                '3': 'NC A',
-                '4': 'RC A',
-                '5': 'NV A',
-                '6': 'FC B',
-                '7': 'ND B',
-                '8': 'NC B',
-                '9': 'RC B',
-                '10': 'NV B',
-                '11': 'FC C',
-                '12': 'ND C',
-                '13': 'NC C',
-                '15': 'RC C',
-                '16': 'NV C',
-                '19': 'FC E',
-                '20': 'ND E',
-                '21': 'NC E',
-                '201': 'FCE A',
-                '202': 'NDE A',
-                '203': 'NCE A',
-                '206': 'FCE B',
-                '207': 'NDE B',
-                '208': 'NCE B',
-                '211': 'FCE C',
-                '212': 'NDE C',
-                '213': 'NCE C',
-                }
-            if invoice.invoice_type.invoice_type in invoice_names:
-                invoice_name = invoice_names[invoice.invoice_type.invoice_type]
-            else:
-                invoice_name = invoice.invoice_type.invoice_type_string or 'FC'
+            invoice_type = invoice.invoice_type
+            code = invoice_type.invoice_type if invoice_type else None
+            invoice_name = cls._get_invoice_names('out').get(code)
+            if not invoice_name and invoice_type:
+                invoice_name = cls._get_selection_labels(
+                    invoice_type.__name__, 'invoice_type').get(code)
+            invoice_name = invoice_name or 'FC'
             invoice_number = invoice.number or ''
         return '%s %s' % (invoice_name, invoice_number)
 
+    @classmethod
+    def _get_selection_labels(cls, model, field):
+        "Return the translated labels of the selection field"
+        language = Transaction().language
+        key = (model, field, language)
+        labels = _selection_labels.get(key)
+        if labels is None:
+            Model = Pool().get(model)
+            selection = Model.fields_get([field])[field]['selection']
+            labels = dict(selection) if isinstance(selection, list) else {}
+            _selection_labels.set(key, labels)
+        return labels
+
     @classmethod
     def _get_voucher_text(cls, voucher):
         if voucher.voucher_type == 'payment':
@@ -144,6 +302,73 @@ class OriginTextMixin:
         return '%s %s' % (voucher_name, voucher_number)
 
 
+class OriginLabelMixin:
+    '''
+    Document which stores again the origin label of the lines of its moves
+    when the fields of the origin text are modified
+    '''
+    __slots__ = ()
+    _origin_label_fields = set()
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        actions = iter(args)
+        to_refresh = []
+        for documents, values in zip(actions, actions):
+            if values.keys() & cls._origin_label_fields:
+                to_refresh.extend(documents)
+        super().write(*args)
+        if to_refresh:
+            Line.refresh_origin_label(to_refresh)
+
+
+class RunningBalanceMixin:
+    '''
+    Build the running balance of the lines
+
+    The lines are always accumulated in the same order so the statement of
+    account and the party balance lines give the same balances.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def _get_running_order(cls, date, number, id_):
+        "Return the columns ordering the running balance"
+        # This sorting criteria must be the order of the statement of account
+        # action, so remember to modify it if you want to change the order.
+        return [date, CharLength(number), number, id_]
+
+    @classmethod
+    def _get_running_balance(cls, amount, order_by, partition_by=None):
+        "Return the window accumulating the amount in the order"
+        return Sum(amount, window=Window(partition_by or [],
+                order_by=order_by))
+
+    @classmethod
+    def _get_prefix_sums(cls, rows, balance=Decimal('0.0'), openings=None):
+        '''
+        Yield the identifier and the running balance of each row without
+        window functions.
+        The rows are tuples of partition, identifier and amount already
+        sorted by partition and in the running order.
+        The openings are the starting balances by partition.
+        '''
+        partition = None
+        start = balance
+        openings = openings or {}
+        for key, id_, amount in rows:
+            if key != partition:
+                partition, balance = key, openings.get(key, start)
+            # SQLite uses float
+            if amount is not None:
+                if not isinstance(amount, Decimal):
+                    amount = Decimal(str(amount))
+                balance += amount
+            yield id_, balance
+
+
 class PartyBalanceAccount(ModelSQL, ModelView):
     'Party Balance Account'
     __name__ = 'party.balance.account'
@@ -155,9 +380,20 @@ class PartyBalanceAccount(ModelSQL, ModelView):
         'get_tax_identifier', searcher='search_tax_identifier')
     currency_digits = fields.Function(fields.Integer('Currency Digits'),
         'get_currency_digits')
-    balance = fields.Function(fields.Numeric('Balance',
-        digits=(16, Eval('currency_digits', 2))),
-        'get_balance', searcher='search_balance')
+    debit = fields.Numeric('Debit',
+        digits=(16, Eval('currency_digits', 2)))
+    credit = fields.Numeric('Credit',
+        digits=(16, Eval('currency_digits', 2)))
+    balance = fields.Numeric('Balance',
+        digits=(16, Eval('currency_digits', 2)))
+    term0 = fields.Function(fields.Numeric('First Term',
+        digits=(16, Eval('currency_digits', 2))), 'get_aging')
+    term1 = fields.Function(fields.Numeric('Second Term',
+        digits=(16, Eval('currency_digits', 2))), 'get_aging')
+    term2 = fields.Function(fields.Numeric('Third Term',
+        digits=(16, Eval('currency_digits', 2))), 'get_aging')
+    term3 = fields.Function(fields.Numeric('Fourth Term',
+        digits=(16, Eval('currency_digits', 2))), 'get_aging')
     lines = fields.One2Many('party.balance.line', 'balance_account', 'Lines',
         readonly=True)
 
@@ -170,28 +406,46 @@ class PartyBalanceAccount(ModelSQL, ModelView):
     def table_query(cls):
         pool = Pool()
         Party = pool.get('party.party')
-        Category = pool.get('party.category')
+        Snapshot = pool.get('party.balance.snapshot')
+        Current = pool.get('party.balance.current')
+        context = Transaction().context
 
         party = Party.__table__()
         category_parties = Literal(True)
-        category = Transaction().context.get('category')
+        category = context.get('category')
         if category:
-            categories = Category.search([
-                ('parent', 'child_of', [category]),
-                ])
-            parties = Party.search([
-                ('categories', 'in', [c.id for c in categories])
-                ])
-            if parties:
-                category_parties = party.id.in_([p.id for p in parties])
-            else:
-                category_parties = Literal(False)
+            category_parties = _category_parties(party.id, category)
+
+        # The totals are columns of the query so the list can be sorted,
+        # filtered and counted on them by the database
+        company_id = context.get('company') or -1
+        if context.get('from_date') or context.get('to_date'):
+            amounts = Snapshot.get_amount_query(company_id,
+                from_date=context.get('from_date'),
+                to_date=context.get('to_date'))
+        else:
+            amounts = Current.get_amount_query(company_id)
+        totals = amounts.select(
+            amounts.party.as_('party'),
+            Sum(amounts.debit).as_('debit'),
+            Sum(amounts.credit).as_('credit'),
+            group_by=amounts.party)
 
         columns = []
         for fname, field in cls._fields.items():
-            if not hasattr(field, 'set'):
-                columns.append(Column(party, fname).as_(fname))
-        return party.select(*columns,
+            if hasattr(field, 'set'):
+                continue
+            if fname in {'debit', 'credit'}:
+                column = Coalesce(Column(totals, fname), 0)
+            elif fname == 'balance':
+                column = (Coalesce(totals.debit, 0)
+                    - Coalesce(totals.credit, 0))
+            else:
+                column = Column(party, fname)
+            columns.append(column.as_(fname))
+        return party.join(totals, 'LEFT',
+            condition=totals.party == party.id
+            ).select(*columns,
             where=(party.active == Literal(True)
                    & category_parties))
 
@@ -199,14 +453,28 @@ class PartyBalanceAccount(ModelSQL, ModelView):
     def get_tax_identifier(cls, parties, names):
         pool = Pool()
         Party = pool.get('party.party')
+        Identifier = pool.get('party.identifier')
+        identifier = Identifier.__table__()
+        cursor = Transaction().connection.cursor()
 
         result = {'tax_identifier': dict((p.id, None) for p in parties)}
+        tax_identifiers = result['tax_identifier']
         types = Party.tax_identifier_types()
-        for p in parties:
-            party, = Party.browse([p.id])
-            for identifier in party.identifiers:
-                result['tax_identifier'][p.id] = identifier.id \
-                    if identifier.type in types else None
+        if not types:
+            return result
+        for sub_parties in grouped_slice(parties):
+            sub_ids = [p.id for p in sub_parties]
+            cursor.execute(*identifier.select(
+                    identifier.party, identifier.id,
+                    where=(reduce_ids(identifier.party, sub_ids)
+                        & identifier.type.in_(list(types))
+                        & (identifier.active == Literal(True))),
+                    order_by=[identifier.party,
+                        NullsFirst(identifier.sequence), identifier.id]))
+            # Keep the first tax identifier like party.party
+            for party_id, identifier_id in cursor:
+                if tax_identifiers[party_id] is None:
+                    tax_identifiers[party_id] = identifier_id
         return result
 
     @classmethod
@@ -237,128 +505,679 @@ class PartyBalanceAccount(ModelSQL, ModelView):
 
     @classmethod
     def get_currency_digits(cls, parties, name):
-        pool = Pool()
-        Company = pool.get('company.company')
-        company_id = Transaction().context.get('company')
-        if company_id:
-            company = Company(company_id)
-            digits = company.currency.digits
-        else:
-            digits = 2
+        digits = company_currency(
+            Transaction().context.get('company') or None).digits
         return {p.id: digits for p in parties}
 
     @classmethod
-    def get_balance(cls, parties, names):
+    def get_aging(cls, parties, names):
         '''
-        Function to compute balance for party ids.
+        Function to compute the aged balance for party ids.
+        The open amounts are split by maturity date in terms which ends at
+        the number of days of the context before the aging date.
         '''
-        result = {}
         pool = Pool()
+        Date = pool.get('ir.date')
         Move = pool.get('account.move')
         MoveLine = pool.get('account.move.line')
-        Account = pool.get('account.account')
-        AccountType = pool.get('account.account.type')
-        User = pool.get('res.user')
+        Reconciliation = pool.get('account.move.reconciliation')
+        Current = pool.get('party.balance.current')
         cursor = Transaction().connection.cursor()
+        context = Transaction().context
 
         move = Move.__table__()
         line = MoveLine.__table__()
-        account = Account.__table__()
-        account_type = AccountType.__table__()
+        reconciliation = Reconciliation.__table__()
+        current = Current.__table__()
 
-        result['balance'] = dict((p.id, Decimal('0.0')) for p in parties)
-
-        user = User(Transaction().user)
-        if not user.company:
+        result = {n: dict((p.id, Decimal('0.0')) for p in parties)
+            for n in names}
+        company_id = context.get('company')
+        if not company_id:
             return result
-        company_id = user.company.id
-        exp = Decimal(str(10.0 ** -user.company.currency.digits))
-
-        amount = Sum(Coalesce(line.debit, 0) - Coalesce(line.credit, 0))
-        from_date_where = to_date_where = Literal(True)
-        if Transaction().context.get('from_date'):
-            from_date_where = (move.date >=
-                    Transaction().context.get('from_date'))
-        if Transaction().context.get('to_date'):
-            to_date_where = (move.date <=
-                    Transaction().context.get('to_date'))
+        with Transaction().set_context(company=company_id):
+            date = context.get('aging_date') or Date.today()
+        limits = [
+            date - datetime.timedelta(
+                days=context.get('term%s' % i) or default)
+            for i, default in [(1, 30), (2, 60), (3, 90)]]
+
+        amount = Coalesce(line.debit, 0) - Coalesce(line.credit, 0)
+        maturity_date = Coalesce(line.maturity_date, move.date)
+        terms = {
+            'term0': maturity_date > limits[0],
+            'term1': (maturity_date <= limits[0])
+            & (maturity_date > limits[1]),
+            'term2': (maturity_date <= limits[1])
+            & (maturity_date > limits[2]),
+            'term3': maturity_date <= limits[2],
+            }
+        # All the terms are computed and cached together as the clients
+        # read them one by one
+        columns = [Sum(Case((t, amount), else_=0)) for t in terms.values()]
         for sub_parties in grouped_slice(parties):
             sub_ids = [p.id for p in sub_parties]
-            party_where = reduce_ids(line.party, sub_ids)
-            cursor.execute(*line.join(move,
-                    condition=move.id == line.move
-                    ).join(account,
-                    condition=account.id == line.account
-                    ).join(account_type,
-                    condition=account.type == account_type.id
-                    ).select(line.party, amount,
-                    where=(
-                        (getattr(account_type, 'payable')
-                         | getattr(account_type, 'receivable'))
-                        & (account.company == company_id)
-                        & party_where
-                        & from_date_where
-                        & to_date_where),
-                    group_by=line.party))
-            for party, value in cursor.fetchall():
-                # SQLite uses float for SUM
-                if not isinstance(value, Decimal):
-                    value = Decimal(str(value))
-                result['balance'][party] = value.quantize(exp)
+            # The sequence of the current balance changes with the lines of
+            # the party so the cached agings of the other parties are kept
+            cursor.execute(*current.select(current.party, current.sequence,
+                    where=(reduce_ids(current.party, sub_ids)
+                        & (current.company == company_id))))
+            sequences = dict(cursor)
+            keys = {i: (company_id, i, sequences.get(i), date, tuple(limits))
+                for i in sub_ids}
+            agings, missing = {}, []
+            for party_id, key in keys.items():
+                cached = _party_agings.get(key)
+                if cached is None:
+                    missing.append(party_id)
+                    agings[party_id] = dict.fromkeys(terms, Decimal('0.0'))
+                else:
+                    agings[party_id] = cached
+            if missing:
+                cursor.execute(*line.join(move,
+                        condition=line.move == move.id
+                        ).join(reconciliation, 'LEFT',
+                        condition=line.reconciliation == reconciliation.id
+                        ).select(line.party, *columns,
+                        where=(reduce_ids(line.party, missing)
+                            & line.payable_receivable
+                            & (move.company == company_id)
+                            & (move.date <= date)
+                            & ((line.reconciliation == Null)
+                                | (reconciliation.date > date))),
+                        group_by=line.party))
+                for party, *values in cursor:
+                    # SQLite uses float for SUM
+                    agings[party] = {
+                        n: _to_decimal(v) for n, v in zip(terms, values)}
+                for party_id in missing:
+                    _party_agings.set(keys[party_id], agings[party_id])
+            for party_id, aging in agings.items():
+                for name in names:
+                    result[name][party_id] = aging[name]
         return result
 
+
+class PartyBalanceSnapshot(ModelSQL):
+    'Party Balance Snapshot'
+    __name__ = 'party.balance.snapshot'
+
+    party = fields.Many2One('party.party', 'Party', required=True,
+        ondelete='CASCADE',
+        context={'company': Eval('company', -1)}, depends={'company'})
+    company = fields.Many2One('company.company', 'Company', required=True,
+        ondelete='CASCADE')
+    account = fields.Many2One('account.account', 'Account', required=True,
+        ondelete='CASCADE')
+    period = fields.Many2One('account.period', 'Period', required=True,
+        ondelete='CASCADE')
+    debit = fields.Numeric('Debit', required=True)
+    credit = fields.Numeric('Credit', required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.company, Index.Equality()),
+                (t.party, Index.Equality()),
+                (t.period, Index.Equality())))
+
+    @classmethod
+    def __register__(cls, module_name):
+        exist = backend.TableHandler.table_exist(cls._table)
+
+        super().__register__(module_name)
+
+        if not exist:
+            cls._insert()
+
     @classmethod
-    def search_balance(cls, name, clause):
+    def _insert(cls):
+        '''
+        Insert the party amounts of all the posted moves grouped by company,
+        account and period.
+        '''
         pool = Pool()
         Move = pool.get('account.move')
-        MoveLine = pool.get('account.move.line')
+        Line = pool.get('account.move.line')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        table = cls.__table__()
+        move = Move.__table__()
+        line = Line.__table__()
+
+        cursor.execute(*table.insert([
+                    table.create_uid, table.create_date,
+                    table.party, table.company, table.account,
+                    table.period, table.debit, table.credit],
+                line.join(move, condition=line.move == move.id
+                    ).select(
+                    Literal(transaction.user), CurrentTimestamp(),
+                    line.party, move.company, line.account, move.period,
+                    Sum(Coalesce(line.debit, 0)),
+                    Sum(Coalesce(line.credit, 0)),
+                    where=((move.state == 'posted')
+                        & (line.party != Null)),
+                    group_by=[line.party, move.company, line.account,
+                        move.period])))
+
+    @classmethod
+    def update_moves(cls, moves, sign=1):
+        '''
+        Add or remove with a negative sign the amounts of the posted moves.
+        The amounts are added to the row of their party, company, account and
+        period which is only inserted if missing.
+        '''
+        pool = Pool()
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        table = cls.__table__()
+        move = Move.__table__()
+        line = Line.__table__()
+
+        amounts = defaultdict(lambda: (Decimal(0), Decimal(0)))
+        for sub_ids in grouped_slice([m.id for m in moves]):
+            cursor.execute(*line.join(move, condition=line.move == move.id
+                    ).select(
+                    line.party, move.company, line.account, move.period,
+                    Sum(Coalesce(line.debit, 0)),
+                    Sum(Coalesce(line.credit, 0)),
+                    where=(reduce_ids(move.id, list(sub_ids))
+                        & (move.state == 'posted')
+                        & (line.party != Null)),
+                    group_by=[line.party, move.company, line.account,
+                        move.period]))
+            for *key, debit, credit in cursor:
+                key = tuple(key)
+                total_debit, total_credit = amounts[key]
+                amounts[key] = (
+                    total_debit + _to_decimal(debit) * sign,
+                    total_credit + _to_decimal(credit) * sign)
+        if not amounts:
+            return
+
+        # Concurrent posts may insert the same bucket twice, the amounts are
+        # still summed right and the first row is updated
+        existing = {}
+        parties = {k[0] for k in amounts}
+        periods = {k[3] for k in amounts}
+        for sub_parties in grouped_slice(parties):
+            cursor.execute(*table.select(
+                    table.id, table.party, table.company, table.account,
+                    table.period,
+                    where=(reduce_ids(table.party, list(sub_parties))
+                        & reduce_ids(table.period, periods)),
+                    order_by=[table.id.desc]))
+            for id_, *key in cursor:
+                existing[tuple(key)] = id_
+
+        values = []
+        for key, (debit, credit) in amounts.items():
+            if key in existing:
+                cursor.execute(*table.update(
+                        [table.debit, table.credit,
+                            table.write_uid, table.write_date],
+                        [table.debit + debit, table.credit + credit,
+                            transaction.user, CurrentTimestamp()],
+                        where=table.id == existing[key]))
+            else:
+                party, company, account, period = key
+                values.append([transaction.user, CurrentTimestamp(),
+                        party, company, account, period, debit, credit])
+        if values:
+            cursor.execute(*table.insert([
+                        table.create_uid, table.create_date,
+                        table.party, table.company, table.account,
+                        table.period, table.debit, table.credit],
+                    values))
+
+    @classmethod
+    def rebuild(cls):
+        "Compute again the snapshot from the posted moves"
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.delete())
+        cls._insert()
+
+    @classmethod
+    def get_amount_query(cls, company_id, from_date=None, to_date=None):
+        '''
+        Return a query with the party, debit and credit of the payable and
+        receivable amounts of the company between the dates.
+        The posted moves of the periods inside the dates are summed from the
+        snapshot and only the remaining lines are read.
+        '''
+        pool = Pool()
         Account = pool.get('account.account')
         AccountType = pool.get('account.account.type')
-        User = pool.get('res.user')
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        Period = pool.get('account.period')
 
-        move = Move.__table__()
-        line = MoveLine.__table__()
+        table = cls.__table__()
+        period = Period.__table__()
         account = Account.__table__()
         account_type = AccountType.__table__()
+        line = Line.__table__()
+        move = Move.__table__()
+        move_period = Period.__table__()
 
-        _, operator, value = clause
+        def inside_dates(period):
+            where = Literal(True)
+            if from_date:
+                where &= period.start_date >= from_date
+            if to_date:
+                where &= period.end_date <= to_date
+            return where
 
-        user = User(Transaction().user)
-        if not user.company:
-            return []
-        company_id = user.company.id
+        date_where = Literal(True)
+        if from_date:
+            date_where &= move.date >= from_date
+        if to_date:
+            date_where &= move.date <= to_date
 
-        from_date_where = to_date_where = Literal(True)
-        if Transaction().context.get('from_date'):
-            from_date_where = (move.date >=
-                    Transaction().context.get('from_date'))
-        if Transaction().context.get('to_date'):
-            to_date_where = (move.date <=
-                    Transaction().context.get('to_date'))
+        snapshot = table.join(period, condition=table.period == period.id
+            ).join(account, condition=table.account == account.id
+            ).join(account_type, condition=account.type == account_type.id
+            ).select(
+                table.party.as_('party'),
+                table.debit.as_('debit'),
+                table.credit.as_('credit'),
+                where=((table.company == company_id)
+                    & inside_dates(period)
+                    & (account_type.payable | account_type.receivable)))
+        remaining = line.join(move, condition=line.move == move.id
+            ).join(move_period, condition=move.period == move_period.id
+            ).select(
+                line.party.as_('party'),
+                Coalesce(line.debit, 0).as_('debit'),
+                Coalesce(line.credit, 0).as_('credit'),
+                where=((move.company == company_id)
+                    & (line.party != Null)
+                    & date_where
+                    & ~((move.state == 'posted')
+                        & inside_dates(move_period))
+                    & line.payable_receivable))
+        return Union(snapshot, remaining, all_=True)
+
+    @classmethod
+    def get_opening_query(cls, company_id, date):
+        '''
+        Return a query with the party and the balance of the payable and
+        receivable amounts of the company before the date.
+        '''
+        amounts = cls.get_amount_query(
+            company_id, to_date=date - datetime.timedelta(days=1))
+        return amounts.select(
+            amounts.party.as_('party'),
+            Sum(amounts.debit - amounts.credit).as_('balance'),
+            group_by=amounts.party)
+
+
+class PartyBalanceChange(ModelSQL):
+    'Party Balance Change'
+    __name__ = 'party.balance.change'
+
+    company = fields.Many2One('company.company', 'Company', required=True,
+        ondelete='CASCADE')
+    party = fields.Many2One('party.party', 'Party', required=True,
+        ondelete='CASCADE',
+        context={'company': Eval('company', -1)}, depends={'company'})
+    account = fields.Many2One('account.account', 'Account', required=True,
+        ondelete='CASCADE')
+    date = fields.Date('Date', required=True)
+    debit = fields.Numeric('Debit', required=True)
+    credit = fields.Numeric('Credit', required=True)
+    kind = fields.Selection([
+            ('move', 'Move'),
+            ('reconciliation', 'Reconciliation'),
+            ], 'Kind', required=True,
+        help='Move changes the balance and reconciliation the open items.')
+
+    @classmethod
+    def _record_lines(cls, kind, where, sign):
+        "Record the changes of the payable and receivable lines"
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        cursor = Transaction().connection.cursor()
+
+        line = Line.__table__()
+        move = Move.__table__()
+        cursor.execute(*line.join(move, condition=line.move == move.id
+                ).select(
+                move.company, line.party, line.account, move.date,
+                Sum(Coalesce(line.debit, 0)),
+                Sum(Coalesce(line.credit, 0)),
+                where=(where(line, move)
+                    & (line.party != Null)
+                    & line.payable_receivable),
+                group_by=[move.company, line.party, line.account,
+                    move.date]))
+        # The changes are recorded whatever the access of the user
+        with without_check_access():
+            return cls.create([{
+                        'company': company,
+                        'party': party,
+                        'account': account,
+                        'date': date,
+                        'debit': _to_decimal(debit) * sign,
+                        'credit': _to_decimal(credit) * sign,
+                        'kind': kind,
+                        }
+                    for company, party, account, date, debit, credit
+                    in cursor.fetchall()])
+
+    @classmethod
+    def record_moves(cls, moves, sign=1):
+        "Record the posting or with a negative sign the removal of the moves"
+        changes = []
+        for sub_ids in grouped_slice([m.id for m in moves]):
+            changes.extend(cls._record_lines('move',
+                    lambda line, move: reduce_ids(move.id, list(sub_ids)),
+                    sign))
+        cls._queue_apply(changes)
 
-        Operator = fields.SQL_OPERATORS[operator]
+    @classmethod
+    def record_reconciliations(cls, reconciliations, sign=-1):
+        '''
+        Record the amounts leaving the open items when the reconciliations
+        are created or with a positive sign coming back when deleted
+        '''
+        changes = []
+        for sub_ids in grouped_slice([r.id for r in reconciliations]):
+            changes.extend(cls._record_lines('reconciliation',
+                    lambda line, move: reduce_ids(
+                        line.reconciliation, list(sub_ids)),
+                    sign))
+        cls._queue_apply(changes)
+
+    @classmethod
+    def record_parties(cls, lines):
+        '''
+        Record a change without amount for the parties of the lines so their
+        current balances get a new sequence
+        '''
+        changes = []
+        for sub_ids in grouped_slice([l.id for l in lines]):
+            changes.extend(cls._record_lines('move',
+                    lambda line, move: reduce_ids(line.id, list(sub_ids)),
+                    0))
+        cls._queue_apply(changes)
+
+    @classmethod
+    def _queue_apply(cls, changes):
+        "Queue the apply of the changes which runs once they are committed"
+        if changes:
+            cls.__queue__.apply(changes)
+
+    @classmethod
+    def apply(cls, changes=None):
+        '''
+        Add the changes or all the pending changes to the current balances of
+        the parties and delete them.
+        The current balances are locked so the applies follow each other and
+        their sequence follows the commit order. The changes already applied
+        by another apply are skipped.
+        '''
+        pool = Pool()
+        Current = pool.get('party.balance.current')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
 
-        # Need to cast numeric for sqlite
-        cast_ = MoveLine.debit.sql_cast
-        amount = cast_(Sum(Coalesce(line.debit, 0) - Coalesce(line.credit, 0)))
-        if operator in {'in', 'not in'}:
-            value = [cast_(Literal(Decimal(v or 0))) for v in value]
+        Current.lock()
+        if changes is None:
+            wheres = [Literal(True)]
         else:
-            value = cast_(Literal(Decimal(value or 0)))
-        query = (line.join(move, condition=move.id == line.move
-                ).join(account, condition=account.id == line.account
-                ).join(account_type, condition=account.type == account_type.id
-                ).select(line.party,
-                where=(
-                    (getattr(account_type, 'payable')
-                    | getattr(account_type, 'receivable'))
+            wheres = [reduce_ids(table.id, sub_ids)
+                for sub_ids in grouped_slice([c.id for c in changes])]
+        deltas = {}
+        for where in wheres:
+            cursor.execute(*table.select(
+                    table.company, table.party, table.kind,
+                    Sum(table.debit), Sum(table.credit),
+                    where=where,
+                    group_by=[table.company, table.party, table.kind]))
+            for company, party, kind, debit, credit in cursor:
+                total_debit, total_credit, open_items = deltas.get(
+                    (company, party), (Decimal(0), Decimal(0), Decimal(0)))
+                debit, credit = _to_decimal(debit), _to_decimal(credit)
+                if kind == 'move':
+                    total_debit += debit
+                    total_credit += credit
+                deltas[company, party] = (
+                    total_debit, total_credit, open_items + debit - credit)
+            cursor.execute(*table.delete(where=where))
+        if deltas:
+            Current.update_balances(deltas)
+
+
+class PartyBalanceCurrent(ModelSQL):
+    'Party Balance Current'
+    __name__ = 'party.balance.current'
+
+    company = fields.Many2One('company.company', 'Company', required=True,
+        ondelete='CASCADE')
+    party = fields.Many2One('party.party', 'Party', required=True,
+        ondelete='CASCADE',
+        context={'company': Eval('company', -1)}, depends={'company'})
+    debit = fields.Numeric('Debit', required=True)
+    credit = fields.Numeric('Credit', required=True)
+    balance = fields.Numeric('Balance', required=True)
+    open_items = fields.Numeric('Open Items', required=True,
+        help='The amount of the unreconciled lines.')
+    sequence = fields.Integer('Sequence', required=True,
+        help='The apply which last changed the balances.')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.company, Index.Equality()),
+                    (t.party, Index.Equality())),
+                Index(t,
+                    (t.company, Index.Equality()),
+                    (t.sequence, Index.Range())),
+                })
+        cls.__rpc__.update({
+                'get_changes': RPC(),
+                })
+
+    @classmethod
+    def __register__(cls, module_name):
+        exist = backend.TableHandler.table_exist(cls._table)
+
+        super().__register__(module_name)
+
+        if not exist:
+            cls._insert()
+
+    @classmethod
+    def _get_sequence(cls):
+        "Return the sequence of a new apply"
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(Max(table.sequence)))
+        sequence, = cursor.fetchone()
+        return (sequence or 0) + 1
+
+    @classmethod
+    def update_balances(cls, deltas):
+        '''
+        Add the deltas of debit, credit and open items keyed by company and
+        party to the current balances with a new sequence.
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+
+        sequence = cls._get_sequence()
+        existing = set()
+        for sub_keys in grouped_slice(list(deltas)):
+            sub_keys = list(sub_keys)
+            cursor.execute(*table.select(table.company, table.party,
+                    where=reduce_ids(table.party, {p for _, p in sub_keys})))
+            existing.update(cursor)
+        values = []
+        for (company, party), (debit, credit, open_items) in deltas.items():
+            if (company, party) in existing:
+                cursor.execute(*table.update(
+                        [table.debit, table.credit, table.balance,
+                            table.open_items, table.sequence,
+                            table.write_uid, table.write_date],
+                        [table.debit + debit, table.credit + credit,
+                            table.balance + (debit - credit),
+                            table.open_items + open_items, sequence,
+                            transaction.user, CurrentTimestamp()],
+                        where=(table.company == company)
+                        & (table.party == party)))
+            else:
+                values.append([transaction.user, CurrentTimestamp(),
+                        company, party, debit, credit, debit - credit,
+                        open_items, sequence])
+        if values:
+            cursor.execute(*table.insert([
+                        table.create_uid, table.create_date,
+                        table.company, table.party, table.debit,
+                        table.credit, table.balance, table.open_items,
+                        table.sequence],
+                    values))
+
+    @classmethod
+    def _insert(cls, sequence=1):
+        "Insert with the sequence the balances of the posted lines"
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        line = Line.__table__()
+        move = Move.__table__()
+
+        debit = Coalesce(line.debit, 0)
+        credit = Coalesce(line.credit, 0)
+        cursor.execute(*table.insert([
+                    table.create_uid, table.create_date,
+                    table.company, table.party, table.debit, table.credit,
+                    table.balance, table.open_items, table.sequence],
+                line.join(move, condition=line.move == move.id
+                    ).select(
+                    Literal(transaction.user), CurrentTimestamp(),
+                    move.company, line.party, Sum(debit), Sum(credit),
+                    Sum(debit - credit),
+                    Sum(Case((line.reconciliation == Null, debit - credit),
+                            else_=0)),
+                    Literal(sequence),
+                    where=((move.state == 'posted')
+                        & (line.party != Null)
+                        & line.payable_receivable),
+                    group_by=[move.company, line.party])))
+
+    @classmethod
+    def rebuild(cls):
+        '''
+        Compute again the current balances with a new sequence and delete the
+        changes already included.
+        '''
+        pool = Pool()
+        Change = pool.get('party.balance.change')
+        table = cls.__table__()
+        change = Change.__table__()
+        cursor = Transaction().connection.cursor()
+
+        cls.lock()
+        cursor.execute(*change.delete())
+        sequence = cls._get_sequence()
+        cursor.execute(*table.delete())
+        cls._insert(sequence)
+
+    @classmethod
+    def get_amount_query(cls, company_id):
+        '''
+        Return a query with the party, debit and credit of the payable and
+        receivable amounts of the company.
+        The current balances are completed by the changes not yet applied and
+        by the lines of the moves not posted.
+        '''
+        pool = Pool()
+        Change = pool.get('party.balance.change')
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        table = cls.__table__()
+        change = Change.__table__()
+        line = Line.__table__()
+        move = Move.__table__()
+
+        current = table.select(
+            table.party.as_('party'),
+            table.debit.as_('debit'),
+            table.credit.as_('credit'),
+            where=table.company == company_id)
+        changes = change.select(
+            change.party.as_('party'),
+            change.debit.as_('debit'),
+            change.credit.as_('credit'),
+            where=(change.company == company_id) & (change.kind == 'move'))
+        remaining = line.join(move, condition=line.move == move.id
+            ).select(
+                line.party.as_('party'),
+                Coalesce(line.debit, 0).as_('debit'),
+                Coalesce(line.credit, 0).as_('credit'),
+                where=((move.company == company_id)
                     & (line.party != Null)
-                    & (account.company == company_id)
-                    & from_date_where
-                    & to_date_where),
-                group_by=line.party,
-                having=Operator(amount, value)))
-        return [('id', 'in', query)]
+                    & (move.state != 'posted')
+                    & line.payable_receivable))
+        return Union(current, changes, remaining, all_=True)
+
+    @classmethod
+    def get_changes(cls, company_id, since=None):
+        '''
+        Return the last sequence with the current balance and open items of
+        the parties of the company changed after the since sequence or of all
+        the parties if since is None.
+        The clients drop the statement pages and balances they cached for
+        the parties returned.
+        '''
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        User = pool.get('res.user')
+        Company = pool.get('company.company')
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        ModelAccess.check(cls.__name__, 'read')
+        if company_id not in User.get_companies():
+            raise AccessError(gettext(
+                    'current_account.msg_balance_changes_company',
+                    company=Company(company_id).rec_name))
+
+        where = table.company == company_id
+        if since is not None:
+            where &= table.sequence > since
+        cursor.execute(*table.select(Max(table.sequence)))
+        version, = cursor.fetchone()
+        result = {
+            'version': version or 0,
+            'parties': {},
+            }
+        cursor.execute(*table.select(
+                table.party, table.balance, table.open_items,
+                where=where))
+        for party, balance, open_items in cursor:
+            result['parties'][party] = {
+                'balance': _to_decimal(balance),
+                'open_items': _to_decimal(open_items),
+                }
+        return result
 
 
 class PartyBalanceAccountContext(ModelView):
@@ -379,6 +1198,18 @@ class PartyBalanceAccountContext(ModelView):
                 ('to_date', '>=', Eval('from_date')),
                 ()),
             ])
+    open_items = fields.Boolean("Open Items Only",
+        help="Only show the lines which are not reconciled.")
+    aging_date = fields.Date("Aging Date",
+        help="The date at which the open amounts are aged.")
+    term1 = fields.Integer("First Term", required=True,
+        help="The number of days of the first aging term.")
+    term2 = fields.Integer("Second Term", required=True,
+        domain=[('term2', '>', Eval('term1', 0))],
+        help="The number of days of the second aging term.")
+    term3 = fields.Integer("Third Term", required=True,
+        domain=[('term3', '>', Eval('term2', 0))],
+        help="The number of days of the third aging term.")
 
     @classmethod
     def default_company(cls):
@@ -392,8 +1223,29 @@ class PartyBalanceAccountContext(ModelView):
     def default_to_date(cls):
         return Transaction().context.get('to_date')
 
+    @classmethod
+    def default_open_items(cls):
+        return Transaction().context.get('open_items', False)
+
+    @classmethod
+    def default_aging_date(cls):
+        return Transaction().context.get('aging_date')
+
+    @classmethod
+    def default_term1(cls):
+        return Transaction().context.get('term1', 30)
+
+    @classmethod
+    def default_term2(cls):
+        return Transaction().context.get('term2', 60)
+
+    @classmethod
+    def default_term3(cls):
+        return Transaction().context.get('term3', 90)
+
 
-class PartyBalanceLine(OriginTextMixin, ModelSQL, ModelView):
+class PartyBalanceLine(
+        OriginTextMixin, RunningBalanceMixin, ModelSQL, ModelView):
     'Party Balance Line'
     __name__ = 'party.balance.line'
 
@@ -402,7 +1254,9 @@ class PartyBalanceLine(OriginTextMixin, ModelSQL, ModelView):
     move = fields.Many2One('account.move', 'Move')
     date = fields.Date('Date')
     maturity_date = fields.Date('Maturity Date')
-    origin_text = fields.Function(fields.Char('Origin'), 'get_origin_text')
+    origin_text = fields.Function(fields.Char('Origin'), 'get_origin_text',
+        searcher='search_origin_text')
+    origin_label = fields.Char('Origin Label', readonly=True)
     move_origin = fields.Function(
         fields.Reference("Move Origin", selection='get_move_origin'),
         'get_move_field', searcher='search_move_field')
@@ -415,78 +1269,303 @@ class PartyBalanceLine(OriginTextMixin, ModelSQL, ModelView):
         digits=(16, Eval('currency_digits', 2)))
     balance = fields.Numeric('Balance',
         digits=(16, Eval('currency_digits', 2)))
+    second_currency = fields.Many2One('currency.currency', 'Second Currency')
+    amount_second_currency = Monetary('Amount Second Currency',
+        currency='second_currency', digits='second_currency')
+    balance_second_currency = Monetary('Second Currency Balance',
+        currency='second_currency', digits='second_currency',
+        help='The running balance of the lines in the second currency.')
     move_description_used = fields.Char('Move Description')
+    move_number = fields.Char('Move Number')
     currency_digits = fields.Function(fields.Integer('Currency Digits'),
         'get_currency_digits')
+    # The opening rows are identified by the party added to this offset
+    # which is above the integer identifiers of the lines
+    _opening_id = 2 ** 31
 
     @classmethod
     def __setup__(cls):
         super().__setup__()
-        cls._order.insert(0, ('date', 'ASC'))
+        # The lines are grouped by party in the same order as the running
+        # balance of each party
+        cls._order.insert(0, ('party', 'ASC'))
+        cls._order.insert(1, ('date', 'ASC'))
+        cls._order.insert(2, ('move_number', 'ASC'))
 
     @classmethod
     def table_query(cls):
         pool = Pool()
         Line = pool.get('account.move.line')
         Move = pool.get('account.move')
-        Account = pool.get('account.account')
-        AccountType = pool.get('account.account.type')
 
         transaction = Transaction()
         context = Transaction().context
         database = transaction.database
         line = Line.__table__()
         move = Move.__table__()
-        account = Account.__table__()
-        account_type = AccountType.__table__()
-        columns = []
-        for fname, field in cls._fields.items():
-            if hasattr(field, 'set'):
-                continue
+
+        company_id = context.get('company')
+        from_date = context.get('from_date')
+
+        opening = None
+        if from_date:
+            opening = cls._get_opening_query(company_id, from_date)
+
+        columns, opening_columns, window_columns = [], [], []
+        for fname, field in cls._fields.items():
+            if hasattr(field, 'set'):
+                continue
             field_line = getattr(Line, fname, None)
+            opening_column = Literal(None)
             if fname == 'balance_account':
                 column = line.party.as_('balance_account')
+                if opening:
+                    opening_column = opening.party
             elif fname == 'balance':
-                if database.has_window_functions():
-                    w_columns = [line.party]
-                    column = Sum(line.debit - line.credit,
-                        window=Window(w_columns,
-                            order_by=[move.date.asc, line.id])).as_('balance')
-                else:
-                    column = (line.debit - line.credit).as_('balance')
+                column = (line.debit - line.credit).as_('balance')
+                if opening:
+                    opening_column = opening.balance
+            elif fname == 'balance_second_currency':
+                # SQLite returns the stored Decimal as bytes
+                column = Line.amount_second_currency.sql_cast(
+                    Coalesce(line.amount_second_currency, 0)).as_(fname)
             elif fname == 'move_description_used':
                 column = Column(move, 'description').as_(fname)
+                opening_column = Literal('Saldo inicial')
+            elif fname == 'move_number':
+                column = move.number.as_(fname)
+                # The empty number sorts the opening row before the moves of
+                # its date
+                opening_column = Literal('')
             elif (not field_line
                     or fname == 'state'
                     or isinstance(field_line, fields.Function)):
                 column = Column(move, fname).as_(fname)
             else:
                 column = Column(line, fname).as_(fname)
+            if opening:
+                if fname == 'id':
+                    opening_column = opening.party + cls._opening_id
+                elif fname == 'party':
+                    opening_column = opening.party
+                elif fname == 'company':
+                    opening_column = Literal(company_id)
+                elif fname == 'date':
+                    opening_column = Literal(from_date)
+                elif fname == 'debit':
+                    opening_column = Case((opening.balance > 0,
+                            opening.balance), else_=0)
+                elif fname == 'credit':
+                    opening_column = Case((opening.balance < 0,
+                            -opening.balance), else_=0)
             columns.append(column)
+            opening_columns.append(opening_column.as_(fname))
+            window_columns.append(fname)
 
-        company_id = context.get('company')
-        party_id = context.get('party')
         where_from_date = where_to_date = Literal(True)
-        if context.get('from_date'):
-            where_from_date = (move.date >= context.get('from_date'))
+        if from_date:
+            where_from_date = (move.date >= from_date)
         if context.get('to_date'):
             where_to_date = (move.date <= context.get('to_date'))
+        where_open_items = Literal(True)
+        if context.get('open_items'):
+            where_open_items = (line.reconciliation == Null)
 
         with Transaction().set_context():
             line_query, fiscalyear_ids = Line.query_get(line)
-        return line.join(move, condition=line.move == move.id
-            ).join(account, condition=line.account == account.id
-            ).join(account_type, condition=account.type == account_type.id
+        query = line.join(move, condition=line.move == move.id
             ).select(*columns, where=(
                 line_query
                 & (move.company == company_id)
-                & (line.party == party_id)
+                & cls._get_party_where(line.party)
                 & where_from_date & where_to_date
-                & (getattr(account_type, 'payable')
-                | getattr(account_type, 'receivable'))))
+                & where_open_items
+                & line.payable_receivable))
+        if opening:
+            query = Union(query, opening.select(*opening_columns,
+                    where=cls._get_party_where(opening.party)), all_=True)
+        if database.has_window_functions():
+            # Each party has its own running balance and its opening row is
+            # ordered first thanks to its empty number
+            from_item = query
+            second_opening = None
+            if from_date:
+                second_opening = cls._get_second_currency_opening_query(
+                    company_id, from_date)
+                from_item = query.join(second_opening, 'LEFT',
+                    condition=(second_opening.party == query.party)
+                    & (second_opening.second_currency
+                        == query.second_currency))
+            columns = []
+            for fname in window_columns:
+                if fname == 'balance':
+                    column = cls._get_running_balance(query.balance,
+                        cls._get_balance_order(query),
+                        partition_by=[query.party]).as_('balance')
+                elif fname == 'balance_second_currency':
+                    balance = cls._get_running_balance(
+                        query.balance_second_currency,
+                        cls._get_balance_order(query),
+                        partition_by=[query.party, query.second_currency])
+                    if second_opening:
+                        balance += Coalesce(second_opening.amount, 0)
+                    column = Case((query.second_currency != Null, balance),
+                        else_=Null).as_(fname)
+                else:
+                    column = Column(query, fname).as_(fname)
+                columns.append(column)
+            query = from_item.select(*columns)
+        return query
+
+    @classmethod
+    def order_party(cls, tables):
+        table, _ = tables[None]
+        return [table.party]
+
+    @classmethod
+    def order_move_number(cls, tables):
+        table, _ = tables[None]
+        return [CharLength(table.move_number), table.move_number]
+
+    @classmethod
+    def _get_balance_order(cls, query):
+        "Return the columns ordering the running balance of the query"
+        return cls._get_running_order(query.date, query.move_number, query.id)
+
+    @classmethod
+    def read(cls, ids, fields_names):
+        rows = super().read(ids, fields_names)
+        database = Transaction().database
+        if not database.has_window_functions():
+            for name in ['balance', 'balance_second_currency']:
+                if name not in fields_names:
+                    continue
+                balances = cls._get_balances(ids, name)
+                for row in rows:
+                    row[name] = balances.get(row['id'])
+        return rows
+
+    @classmethod
+    def _get_balances(cls, ids, name='balance'):
+        "Return the running balances computed in a single ordered pass"
+        transaction = Transaction()
+        context = transaction.context
+        cursor = transaction.connection.cursor()
+        query = cls.table_query()
+
+        openings = {}
+        if name == 'balance':
+            partition = [query.party]
+        else:
+            partition = [query.party, query.second_currency]
+            if context.get('from_date'):
+                opening = cls._get_second_currency_opening_query(
+                    context.get('company'), context['from_date'])
+                cursor.execute(*opening.select(
+                        opening.party, opening.second_currency,
+                        opening.amount))
+                # SQLite uses float for SUM
+                openings = {(p, c): Decimal(str(a)) for p, c, a in cursor}
+
+        balances = {}
+        for sub_ids in grouped_slice(ids):
+            requested = cls.table_query()
+            parties = requested.select(requested.party,
+                where=reduce_ids(requested.id, list(sub_ids)))
+            # Without window the balance columns hold the amount of the line
+            cursor.execute(*query.select(
+                    *partition, query.id, Column(query, name),
+                    where=query.party.in_(parties),
+                    order_by=partition + cls._get_balance_order(query)))
+            rows = ((tuple(key) if len(key) > 1 else key[0], id_, amount)
+                for *key, id_, amount in cursor)
+            for id_, balance in cls._get_prefix_sums(rows, openings=openings):
+                balances[id_] = balance
+            if name == 'balance_second_currency':
+                cursor.execute(*query.select(query.id,
+                        where=query.party.in_(parties)
+                        & (query.second_currency == Null)))
+                for id_, in cursor:
+                    balances[id_] = None
+        return balances
 
-    def get_currency_digits(self, name):
-        return self.company.currency.digits
+    @classmethod
+    def _get_party_where(cls, column):
+        '''
+        Return the condition on the party column for the context
+        The parties are taken from the party, parties or category key.
+        '''
+        context = Transaction().context
+        if context.get('party'):
+            return column == context['party']
+        elif context.get('parties'):
+            return reduce_ids(column, context['parties'])
+        elif context.get('category'):
+            return _category_parties(column, context['category'])
+        return Literal(False)
+
+    @classmethod
+    def _get_second_currency_opening_query(cls, company_id, date):
+        '''
+        Return a query with the party, the second currency and the amount in
+        this currency before the date
+        '''
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+
+        line = Line.__table__()
+        move = Move.__table__()
+        where = ((move.company == company_id)
+            & cls._get_party_where(line.party)
+            & (line.second_currency != Null)
+            & (move.date < date)
+            & line.payable_receivable)
+        if Transaction().context.get('open_items'):
+            where &= line.reconciliation == Null
+        return line.join(move, condition=line.move == move.id
+            ).select(
+                line.party.as_('party'),
+                line.second_currency.as_('second_currency'),
+                Sum(Coalesce(line.amount_second_currency, 0)).as_('amount'),
+                where=where,
+                group_by=[line.party, line.second_currency])
+
+    @classmethod
+    def _get_opening_query(cls, company_id, date):
+        "Return a query with the party and the balance before the date"
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        Snapshot = pool.get('party.balance.snapshot')
+
+        if not Transaction().context.get('open_items'):
+            return Snapshot.get_opening_query(company_id, date)
+
+        # The snapshot does not know the reconciliations
+        line = Line.__table__()
+        move = Move.__table__()
+        return line.join(move, condition=line.move == move.id
+            ).select(
+                line.party.as_('party'),
+                Sum(Coalesce(line.debit, 0) - Coalesce(line.credit, 0)
+                    ).as_('balance'),
+                where=((move.company == company_id)
+                    & (line.party != Null)
+                    & (line.reconciliation == Null)
+                    & (move.date < date)
+                    & line.payable_receivable),
+                group_by=line.party)
+
+    @classmethod
+    def _get_invoice_names(cls, type_):
+        return Pool().get('account.move.line')._get_invoice_names(type_)
+
+    @classmethod
+    def get_currency_digits(cls, lines, name):
+        return {l.id: company_currency(
+                l.company.id if l.company else None).digits
+            for l in lines}
 
     @classmethod
     def get_move_origin(cls):
@@ -497,6 +1576,9 @@ class PartyBalanceLine(OriginTextMixin, ModelSQL, ModelView):
         field = getattr(self.__class__, name)
         if name.startswith('move_'):
             name = name[5:]
+        if not self.move:
+            # Opening balance row
+            return None
         value = getattr(self.move, name)
         if isinstance(value, ModelSQL):
             if field._type == 'reference':
@@ -512,171 +1594,488 @@ class PartyBalanceLine(OriginTextMixin, ModelSQL, ModelView):
         return [('move.' + name + nested,) + tuple(clause[1:])]
 
 
-class Line(OriginTextMixin, metaclass=PoolMeta):
+class Line(OriginTextMixin, RunningBalanceMixin, metaclass=PoolMeta):
     __name__ = 'account.move.line'
 
-    origin_text = fields.Function(fields.Char('Origin'), 'get_origin_text')
+    origin_text = fields.Function(fields.Char('Origin'), 'get_origin_text',
+        searcher='search_origin_text')
+    origin_label = fields.Char('Origin Label', readonly=True)
+    payable_receivable = fields.Boolean('Payable or Receivable',
+        readonly=True,
+        help='If the account of the line is payable or receivable.')
     balance = fields.Function(fields.Numeric('Balance',
         digits=(16, 2)), 'get_balance')
+    balance_second_currency = fields.Function(Monetary(
+            'Second Currency Balance',
+            currency='second_currency', digits='second_currency',
+            help='The running balance of the lines in the second currency.'),
+        'get_balance')
     visual_attribute = fields.Function(fields.Char('Visual Attribute'),
         'get_visual_attribute')
 
     @classmethod
-    def get_balance(cls, lines, name):
-        if not lines:
-            return {}
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls.__rpc__.update({
+                'search_statement': RPC(),
+                })
+        # The conditions have no parameter so SQLite creates them too
+        cls._sql_indexes.update({
+                Index(t, (t.origin_label, Index.Similarity())),
+                # Index for the open items of the statements
+                Index(
+                    t,
+                    (t.party, Index.Equality()),
+                    (t.account, Index.Equality()),
+                    where=(t.reconciliation == Null) & t.payable_receivable),
+                # Covering index for the statements and the balances
+                Index(
+                    t,
+                    (t.party, Index.Equality()),
+                    (t.account, Index.Equality()),
+                    include=[t.move, t.debit, t.credit],
+                    where=t.payable_receivable),
+                })
+
+    @classmethod
+    def __register__(cls, module_name):
+        table_h = cls.__table_handler__(module_name)
+        exist = table_h.column_exist('payable_receivable')
+
+        super().__register__(module_name)
+
+        if not exist:
+            cls.update_payable_receivable()
+
+    @classmethod
+    def _get_balance_order(cls, line, move):
+        "Return the columns ordering the lines of the running balance"
+        return cls._get_running_order(move.date, move.number, line.id)
+
+    @classmethod
+    def _get_balance_query(cls, line, move):
+        '''
+        Return the from item and the where clause selecting the lines
+        accumulated by the running balance depending of the context.
+        '''
+        pool = Pool()
+        Period = pool.get('account.period')
+        context = Transaction().context
+
+        # The from item is always the same and the context values are bound
+        # as parameters so the statements differ only by the filters used
+        from_ = line.join(move, condition=line.move == move.id)
+        where = Literal(True)
+        if context.get('fiscalyear'):
+            period = Period.__table__()
+            where &= move.period.in_(period.select(period.id,
+                    where=period.fiscalyear == int(context['fiscalyear'])))
+        if context.get('journal'):
+            where &= move.journal == int(context['journal'])
+        if context.get('period'):
+            where &= move.period == int(context['period'])
+        if context.get('from_date'):
+            where &= move.date >= context['from_date']
+        if context.get('to_date'):
+            where &= move.date <= context['to_date']
+        if context.get('account'):
+            where &= line.account == int(context['account'])
+        if context.get('company'):
+            where &= move.company == int(context['company'])
+        if context.get('party'):
+            where &= line.party == int(context['party'])
+        if context.get('open_items'):
+            where &= line.reconciliation == Null
+        if context.get('account_kind'):
+            where &= line.payable_receivable
+        return from_, where
+
+    @classmethod
+    def _get_opening_balance(cls, second_currency=False):
+        '''
+        Return the balance of the lines before the from_date of the context.
+        With second_currency, return the balances in second currency by
+        currency.
+        '''
+        pool = Pool()
+        Move = pool.get('account.move')
+        Snapshot = pool.get('party.balance.snapshot')
+        transaction = Transaction()
+        context = transaction.context
+        cursor = transaction.connection.cursor()
+
+        from_date = context.get('from_date')
+        if not from_date:
+            return {} if second_currency else Decimal('0.0')
+
+        line = cls.__table__()
+        move = Move.__table__()
+        with transaction.set_context(from_date=None):
+            from_, where = cls._get_balance_query(line, move)
+        where &= move.date < from_date
+        if second_currency:
+            cursor.execute(*from_.select(
+                    line.second_currency,
+                    Sum(Coalesce(line.amount_second_currency, 0)),
+                    where=where & (line.second_currency != Null),
+                    group_by=line.second_currency))
+            return {c: _to_decimal(b) for c, b in cursor}
+
+        if (context.get('company') and context.get('party')
+                and context.get('account_kind')
+                and not any(context.get(k) for k in [
+                        'fiscalyear', 'journal', 'period', 'account',
+                        'open_items'])):
+            # Use the checkpoints of the snapshot
+            opening = Snapshot.get_opening_query(
+                int(context['company']), from_date)
+            cursor.execute(*opening.select(opening.balance,
+                    where=opening.party == int(context['party'])))
+        else:
+            cursor.execute(*from_.select(
+                    Sum(Coalesce(line.debit, 0) - Coalesce(line.credit, 0)),
+                    where=where))
+        row = cursor.fetchone()
+        return _to_decimal(row[0] if row else None)
+
+    @classmethod
+    def get_balance(cls, lines, names):
+        pool = Pool()
+        Currency = pool.get('currency.currency')
+        Move = pool.get('account.move')
+        transaction = Transaction()
 
+        if not lines:
+            return {n: {} for n in names}
         ids = [x.id for x in lines]
-        res = {}.fromkeys(ids, Decimal('0.0'))
-        fiscalyear_id = journal_id = period_id = account_id = None
-        from_date = to_date = None
-        company_id = party_id = account_kind = None
-
-        from_fiscalyear = where_fiscalyear = ''
-        if Transaction().context.get('fiscalyear'):
-            fiscalyear_id = int(Transaction().context.get('fiscalyear'))
-        if fiscalyear_id:
-            from_fiscalyear = '''
-                LEFT JOIN account_period ap ON (ap.id=am.period)
-                LEFT JOIN account_fiscalyear af ON (af.id=ap.fiscalyear)
-                '''
-            where_fiscalyear = '''
-                ap.fiscalyear = %d AND
-                ''' % fiscalyear_id
-
-        where_journal = ''
-        if Transaction().context.get('journal'):
-            journal_id = int(Transaction().context.get('journal'))
-        if journal_id:
-            where_journal = '''
-                am.journal = %d AND
-                ''' % journal_id
-
-        where_period = ''
-        if Transaction().context.get('period'):
-            period_id = int(Transaction().context.get('period'))
-        if period_id:
-            where_period = '''
-                am.period = %d AND
-                ''' % period_id
-
-        where_from_date = ''
-        if Transaction().context.get('from_date'):
-            from_date = Transaction().context.get('from_date')
-        if from_date:
-            where_from_date = '''
-                am.date >= '%s' AND
-                ''' % from_date
 
-        where_to_date = ''
-        if Transaction().context.get('to_date'):
-            to_date = Transaction().context.get('to_date')
-        if to_date:
-            where_to_date = '''
-                am.date <= '%s' AND
-                ''' % to_date
-
-        where_account = ''
-        if Transaction().context.get('account'):
-            account_id = int(Transaction().context.get('account'))
-        if account_id:
-            where_account = '''
-                aml.account = %d AND
-                ''' % account_id
-
-        where_company = ''
-        if Transaction().context.get('company'):
-            company_id = int(Transaction().context.get('company'))
-        if company_id:
-            where_company = '''
-                am.company = %d AND
-                ''' % company_id
-
-        where_party = ''
-        if Transaction().context.get('party'):
-            party_id = int(Transaction().context.get('party'))
-        if party_id:
-            where_party = '''
-                aml.party = %d AND
-                ''' % party_id
-
-        from_account_kind = where_account_kind = ''
-        if Transaction().context.get('account_kind'):
-            account_kind = list(Transaction().context.get('account_kind'))
-        if account_kind:
-            from_account_kind = ', account_account a, account_account_type at'
-            where_account_kind = ('aml.account = a.id '
-                'AND a.type = at.id '
-                'AND (at.payable IS TRUE OR at.receivable IS TRUE) AND ')
+        line = cls.__table__()
+        move = Move.__table__()
+        from_, where = cls._get_balance_query(line, move)
+        order_by = cls._get_balance_order(line, move)
 
-        cursor = Transaction().connection.cursor()
-        for line in lines:
-            id = line.id
-            date = line.move.date
-            number = line.move.number
-            debit = line.debit or Decimal('0.0')
-            credit = line.credit or Decimal('0.0')
-
-            cursor.execute("""
-                SELECT
-                    SUM(debit-credit)
-                FROM
-                    account_move am""" + from_fiscalyear + """,
-                    account_move_line aml""" + from_account_kind + """
-                WHERE """ + where_fiscalyear + where_journal
-                    + where_from_date + where_to_date + where_company
-                    + where_period + where_account + where_party
-                    + where_account_kind + """
-                    aml.move = am.id
-                    AND (
-                        am.date < %s
-                        OR (am.date = %s AND am.number < %s)
-                        OR (am.date = %s AND am.number = %s
-                            AND aml.id < %s)
-                    )
-                """, (date, date, number, date, number, id))
-            balance = cursor.fetchone()[0] or Decimal('0.0')
-            if not isinstance(balance, Decimal):
-                balance = Decimal(balance)
-            balance += debit - credit
-            res[id] = balance
+        result = {}
+        if 'balance' in names:
+            balances = cls._get_running_balances(ids, line, from_, where,
+                order_by, Coalesce(line.debit, 0) - Coalesce(line.credit, 0),
+                openings={None: cls._get_opening_balance()})
+            exponent = company_currency(
+                transaction.context.get('company') or None).exponent
+            # SQLite sums float
+            result['balance'] = {i: b.quantize(exponent)
+                for i, (_, b) in balances.items()}
+        if 'balance_second_currency' in names:
+            # SQLite returns the stored Decimal as bytes
+            amount = cls.amount_second_currency.sql_cast(
+                Coalesce(line.amount_second_currency, 0))
+            balances = cls._get_running_balances(ids, line, from_, where,
+                order_by, amount,
+                partition=line.second_currency,
+                openings=cls._get_opening_balance(second_currency=True))
+            exponents = {c.id: Decimal(1).scaleb(-c.digits)
+                for c in Currency.browse(
+                    {c for c, _ in balances.values() if c is not None})}
+            result['balance_second_currency'] = {
+                i: b.quantize(exponents[c]) if c is not None else None
+                for i, (c, b) in balances.items()}
+        return result
+
+    @classmethod
+    def _get_running_balances(cls, ids, line, from_, where, order_by, amount,
+            partition=None, openings=None):
+        '''
+        Return the partition key and the running balance of the amount for
+        each line id.
+        The lines matching where are accumulated in their partition starting
+        from the openings by key.
+        '''
+        transaction = Transaction()
+        database = transaction.database
+        cursor = transaction.connection.cursor()
+        openings = openings or {}
+
+        if partition is not None:
+            key, partition_by = partition, [partition]
+        else:
+            key, partition_by = Literal(None), None
+        res = {}
+        if not ids:
+            return res
+        # The window is computed once up to the date of the last requested
+        # line and only the lines from the date of the first are returned
+        date = order_by[0]
+        first = last = None
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*from_.select(Min(date), Max(date),
+                    where=reduce_ids(line.id, list(sub_ids))))
+            low, high = cursor.fetchone()
+            if low is not None:
+                first = low if first is None else min(first, low)
+                last = high if last is None else max(last, high)
+        if last is None:
+            return res
+        where_last = date <= last
+        # The requested lines not matching where still get their balance but
+        # only the matching lines are accumulated.
+        matching = Case((where, 1), else_=0)
+
+        if database.has_window_functions():
+            requested = set(ids)
+            query = from_.select(
+                line.id.as_('id'),
+                date.as_('date'),
+                key.as_('key'),
+                cls._get_running_balance(amount, order_by,
+                    partition_by=partition_by).as_('balance'),
+                where=where & where_last)
+            cursor.execute(*query.select(query.id, query.key, query.balance,
+                    where=query.date >= first))
+            for id_, key_, balance in cursor:
+                if id_ in requested:
+                    res[id_] = (key_, openings.get(key_, Decimal('0.0'))
+                        + _to_decimal(balance))
+            # The balance of the lines not matching where needs the matching
+            # lines before them, those lines are rare so each slice has its
+            # own window
+            missing = [i for i in ids if i not in res]
+            for sub_ids in grouped_slice(missing):
+                sub_ids = list(sub_ids)
+                query = from_.select(
+                    line.id.as_('id'),
+                    key.as_('key'),
+                    amount.as_('amount'),
+                    cls._get_running_balance(Case((where, amount), else_=0),
+                        order_by, partition_by=partition_by).as_('balance'),
+                    where=(where & where_last) | reduce_ids(line.id, sub_ids))
+                cursor.execute(*query.select(
+                        query.id, query.key, query.amount, query.balance,
+                        where=reduce_ids(query.id, sub_ids)))
+                for id_, key_, amount_, balance in cursor:
+                    res[id_] = (key_, openings.get(key_, Decimal('0.0'))
+                        + _to_decimal(balance) + _to_decimal(amount_))
+        else:
+            # Compute the prefix sums in a single ordered pass
+            cursor.execute(*from_.select(
+                    line.id, key, matching, amount,
+                    where=(where | reduce_ids(line.id, ids)) & where_last,
+                    order_by=order_by))
+            remaining = set(ids)
+            balances = {}
+            for id_, key_, matching_, amount_ in cursor:
+                balance = balances.get(
+                    key_, openings.get(key_, Decimal('0.0')))
+                amount_ = _to_decimal(amount_)
+                if id_ in remaining:
+                    res[id_] = (key_, balance + amount_)
+                    remaining.discard(id_)
+                    if not remaining:
+                        break
+                if matching_:
+                    balances[key_] = balance + amount_
         return res
 
     @classmethod
-    def search(cls, args, offset=0, limit=None, order=None, count=False,
-            query=False):
+    def search_statement(cls, domain, cursor=None, limit=None):
+        '''
+        Return a page of the lines matching the domain with their running
+        balance ordered like the balance and the cursor of the next page.
+
+        The cursor is the list of the ordering values and the balance of the
+        last line of the previous page. The page is read after this key and
+        the balance continues from the cursor balance so each page has the
+        same cost whatever its position.
+
+        It is only available through RPC: the list of the statement of
+        account still pages with offset as the client does not pass a
+        cursor, it reads the balances with get_balance.
+        '''
+        pool = Pool()
+        Move = pool.get('account.move')
+        db_cursor = Transaction().connection.cursor()
+
+        line = cls.__table__()
+        move = Move.__table__()
+        order = cls._get_balance_order(line, move)
+
+        where = line.id.in_(cls.search(domain, order=[], query=True))
+        if cursor:
+            *key, balance = cursor
+            after = Literal(False)
+            for column, value in reversed(list(zip(order, key))):
+                after = (column > value) | ((column == value) & after)
+            where &= after
+            balance = Decimal(str(balance))
+        else:
+            balance = cls._get_opening_balance()
+
+        db_cursor.execute(*line.join(move, condition=line.move == move.id
+                ).select(
+                *order,
+                Coalesce(line.debit, 0) - Coalesce(line.credit, 0),
+                where=where,
+                order_by=order,
+                limit=limit))
+        lines = []
+        key = None
+        for *key, amount in db_cursor:
+            # SQLite uses float
+            if not isinstance(amount, Decimal):
+                amount = Decimal(str(amount))
+            balance += amount
+            lines.append((key[-1], balance))
+        return {
+            'lines': lines,
+            'cursor': key + [balance] if key else None,
+            }
+
+    @classmethod
+    def copy(cls, lines, default=None):
+        if default is None:
+            default = {}
+        else:
+            default = default.copy()
+        default.setdefault('origin_label', None)
+        return super().copy(lines, default=default)
+
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        Change = pool.get('party.balance.change')
+        lines = super().create(vlist)
+        cls.update_payable_receivable(lines=lines)
+        Change.record_parties(lines)
+        return lines
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Change = pool.get('party.balance.change')
+        actions = iter(args)
+        to_update, to_record, to_record_before = [], [], []
+        for lines, values in zip(actions, actions):
+            if 'account' in values:
+                to_update.extend(lines)
+            # The parties leaving the lines are also changed
+            if values.keys() & {'party', 'account', 'move'}:
+                to_record_before.extend(lines)
+            if values.keys() & {'party', 'account', 'move', 'debit',
+                    'credit', 'maturity_date'}:
+                to_record.extend(lines)
+        if to_record_before:
+            Change.record_parties(to_record_before)
+        super().write(*args)
+        if to_update:
+            cls.update_payable_receivable(lines=to_update)
+        if to_record:
+            Change.record_parties(to_record)
+
+    @classmethod
+    def delete(cls, lines):
+        pool = Pool()
+        Change = pool.get('party.balance.change')
+        Change.record_parties(lines)
+        super().delete(lines)
+
+    @classmethod
+    def update_payable_receivable(cls, lines=None, accounts=None, types=None):
+        '''
+        Store if the account of the lines is payable or receivable.
+        The lines are those given, of the accounts or of the account types or
+        else all.
+        '''
+        pool = Pool()
+        Account = pool.get('account.account')
+        AccountType = pool.get('account.account.type')
+        table = cls.__table__()
+        account = Account.__table__()
+        account_type = AccountType.__table__()
+        type_account = Account.__table__()
         cursor = Transaction().connection.cursor()
-        Move = Pool().get('account.move')
 
-        lines = super().search(args, offset, limit, order, count, query)
+        if lines is not None:
+            wheres = [reduce_ids(table.id, sub_ids)
+                for sub_ids in grouped_slice([l.id for l in lines])]
+        elif accounts is not None:
+            wheres = [reduce_ids(table.account, sub_ids)
+                for sub_ids in grouped_slice([a.id for a in accounts])]
+        elif types is not None:
+            wheres = [table.account.in_(type_account.select(
+                        type_account.id,
+                        where=reduce_ids(type_account.type, sub_ids)))
+                for sub_ids in grouped_slice([t.id for t in types])]
+        else:
+            wheres = [Literal(True)]
+        value = account.join(account_type,
+            condition=account.type == account_type.id
+            ).select(account_type.payable | account_type.receivable,
+            where=account.id == table.account)
+        for where in wheres:
+            cursor.execute(*table.update(
+                    [table.payable_receivable],
+                    [Coalesce(value, Literal(False))],
+                    where=where))
 
+    @classmethod
+    def set_origin_label(cls, lines):
+        "Store the origin text of the lines"
         table = cls.__table__()
-        move = Move.__table__()
+        cursor = Transaction().connection.cursor()
 
-        if lines and isinstance(lines, list):
-            red_sql = reduce_ids(table.id, [x.id for x in lines])
+        label_ids = defaultdict(list)
+        for line_id, text in cls._get_origin_texts(lines).items():
+            label_ids[text].append(line_id)
+        # Use SQL to also store the label of the posted lines
+        for label, ids in label_ids.items():
+            for sub_ids in grouped_slice(ids):
+                cursor.execute(*table.update(
+                        [table.origin_label], [label],
+                        where=reduce_ids(table.id, sub_ids)))
+
+    @classmethod
+    def rebuild_origin_label(cls, missing=True):
+        "Store the origin text of the lines of the posted moves"
+        pool = Pool()
+        Move = pool.get('account.move')
+        table = cls.__table__()
+        move = Move.__table__()
+        cursor = Transaction().connection.cursor()
 
-            # This sorting criteria must be the one used by the 'balance'
-            # functional field above, so remember to modify that if you
-            # want to change the order.
-            cursor.execute(*table.join(move, condition=table.move == move.id
-                    ).select(table.id,
-                    where=red_sql,
-                    order_by=(move.date, move.number, table.id)))
+        where = move.state == 'posted'
+        if missing:
+            where &= table.origin_label == Null
+        cursor.execute(*table.join(move, condition=table.move == move.id
+                ).select(table.id, where=where))
+        ids = [i for i, in cursor]
+        for sub_ids in grouped_slice(ids):
+            cls.set_origin_label(cls.browse(sub_ids))
 
-            result = cursor.fetchall()
-            ids = [x[0] for x in result]
-            lines = cls.browse(ids)
-        return lines
+    @classmethod
+    def refresh_origin_label(cls, documents):
+        "Store again the origin text of the lines of the documents moves"
+        lines = []
+        for sub_documents in grouped_slice(documents):
+            lines.extend(cls.search([
+                        ('move.origin', 'in', [str(d) for d in sub_documents]),
+                        ], order=[]))
+        cls.set_origin_label(lines)
 
-    def get_visual_attribute(self, name):
-        result = ''
-        document = self.move_origin
-        origin = str(document)
-        model = origin[:origin.find(',')]
-        if model == 'account.voucher':
-            if document.state == 'cancelled':
-                result = 'muted'
+    @classmethod
+    def get_visual_attribute(cls, lines, name):
+        pool = Pool()
+        result = {}
+        voucher_lines = defaultdict(list)
+        for line in lines:
+            result[line.id] = ''
+            origin = cls._get_line_origin(line)
+            if origin and origin.__name__ == 'account.voucher':
+                voucher_lines[origin.id].append(line.id)
+        if voucher_lines:
+            Voucher = pool.get('account.voucher')
+            for voucher in Voucher.browse(list(voucher_lines)):
+                if voucher.state == 'cancelled':
+                    for line_id in voucher_lines[voucher.id]:
+                        result[line_id] = 'muted'
         return result
 
     @classmethod
@@ -686,6 +2085,177 @@ class Line(OriginTextMixin, metaclass=PoolMeta):
             ]
 
 
+class Move(OriginLabelMixin, metaclass=PoolMeta):
+    __name__ = 'account.move'
+    _origin_label_fields = {'number'}
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            # Index for the running balance order of the statements
+            Index(
+                t,
+                (t.company, Index.Equality()),
+                (t.date, Index.Range()),
+                (t.number, Index.Range()),
+                include=[t.id]))
+
+    @dualmethod
+    @ModelView.button
+    def post(cls, moves):
+        pool = Pool()
+        Snapshot = pool.get('party.balance.snapshot')
+        Line = pool.get('account.move.line')
+        Change = pool.get('party.balance.change')
+        # Posting again a posted move must not add its amounts twice
+        to_post = [m for m in moves if m.state != 'posted']
+        super().post(moves)
+        Snapshot.update_moves(to_post)
+        Change.record_moves(to_post)
+        Line.set_origin_label([l for m in to_post for l in m.lines])
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Change = pool.get('party.balance.change')
+        actions = iter(args)
+        to_record = []
+        for moves, values in zip(actions, actions):
+            if 'date' in values:
+                to_record.extend(moves)
+        super().write(*args)
+        # The aging depends on the date of the moves
+        if to_record:
+            Change.record_parties([l for m in to_record for l in m.lines])
+
+    @classmethod
+    def delete(cls, moves):
+        pool = Pool()
+        Snapshot = pool.get('party.balance.snapshot')
+        Change = pool.get('party.balance.change')
+        # Modules allowing to delete posted moves must update the balances
+        posted = [m for m in moves if m.state == 'posted']
+        if posted:
+            Snapshot.update_moves(posted, sign=-1)
+            Change.record_moves(posted, sign=-1)
+        super().delete(moves)
+
+
+class Reconciliation(metaclass=PoolMeta):
+    __name__ = 'account.move.reconciliation'
+
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        Change = pool.get('party.balance.change')
+        reconciliations = super().create(vlist)
+        Change.record_reconciliations(reconciliations)
+        return reconciliations
+
+    @classmethod
+    def delete(cls, reconciliations):
+        pool = Pool()
+        Change = pool.get('party.balance.change')
+        Change.record_reconciliations(reconciliations, sign=1)
+        super().delete(reconciliations)
+
+
+class Invoice(OriginLabelMixin, metaclass=PoolMeta):
+    __name__ = 'account.invoice'
+    _origin_label_fields = {
+        'type', 'number', 'reference', 'tipo_comprobante', 'invoice_type'}
+
+
+class Voucher(OriginLabelMixin, metaclass=PoolMeta):
+    __name__ = 'account.voucher'
+    _origin_label_fields = {'voucher_type', 'number'}
+
+
+class Account(metaclass=PoolMeta):
+    __name__ = 'account.account'
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Current = pool.get('party.balance.current')
+        Line = pool.get('account.move.line')
+        actions = iter(args)
+        to_update = []
+        for accounts, values in zip(actions, actions):
+            if 'type' in values:
+                to_update.extend(accounts)
+        super().write(*args)
+        if to_update:
+            Line.update_payable_receivable(accounts=to_update)
+            Current.rebuild()
+
+
+class AccountType(metaclass=PoolMeta):
+    __name__ = 'account.account.type'
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Current = pool.get('party.balance.current')
+        Line = pool.get('account.move.line')
+        actions = iter(args)
+        to_update = []
+        for types, values in zip(actions, actions):
+            if {'payable', 'receivable'} & values.keys():
+                to_update.extend(types)
+        super().write(*args)
+        if to_update:
+            Line.update_payable_receivable(types=to_update)
+            Current.rebuild()
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.method.selection.append(
+            ('party.balance.snapshot|rebuild',
+                "Rebuild Party Balance Snapshot"))
+        cls.method.selection.append(
+            ('party.balance.change|apply', "Apply Party Balance Changes"))
+        cls.method.selection.append(
+            ('party.balance.current|rebuild',
+                "Rebuild Party Balance Current"))
+
+
+class RebuildOriginLabelStart(ModelView):
+    'Rebuild Origin Label Start'
+    __name__ = 'account.move.line.rebuild_origin_label.start'
+
+    missing = fields.Boolean('Only Missing',
+        help='Only compute the lines without stored origin.')
+
+    @staticmethod
+    def default_missing():
+        return True
+
+
+class RebuildOriginLabel(Wizard):
+    'Rebuild Origin Label'
+    __name__ = 'account.move.line.rebuild_origin_label'
+
+    start = StateView('account.move.line.rebuild_origin_label.start',
+        'current_account.rebuild_origin_label_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Rebuild', 'rebuild', 'tryton-ok', default=True),
+            ])
+    rebuild = StateTransition()
+
+    def transition_rebuild(self):
+        Line = Pool().get('account.move.line')
+        Line.rebuild_origin_label(missing=self.start.missing)
+        return 'end'
+
+
 class OpenStatementOfAccount(Wizard):
     'Open Statement of Account'
     __name__ = 'account.move.line.balance'
@@ -700,9 +2270,7 @@ class OpenStatementOfAccount(Wizard):
         pyson_domain = [
                 ('move.company', '=', Transaction().context['company']),
                 ('party', '=', Transaction().context['active_id']),
-                ['OR',
-                    ('account.type.payable', '=', True),
-                    ('account.type.receivable', '=', True)],
+                ('payable_receivable', '=', True),
                 ]
         pyson_context = {
                 'company': Transaction().context['company'],
@@ -718,6 +2286,9 @@ class OpenStatementOfAccount(Wizard):
             pyson_domain.append(
                 ('date', '<=', Transaction().context['to_date']))
             pyson_context['to_date'] = Transaction().context['to_date']
+        if Transaction().context.get('open_items'):
+            pyson_domain.append(('reconciliation', '=', None))
+            pyson_context['open_items'] = True
 
         action['pyson_domain'] = PYSONEncoder().encode(pyson_domain)
         action['pyson_context'] = PYSONEncoder().encode(pyson_context)
@@ -725,9 +2296,401 @@ class OpenStatementOfAccount(Wizard):
         return action, {}
 
 
-class StatementOfAccountReport(CompanyReport):
+class StatementBatch(Workflow, ModelSQL, ModelView):
+    'Statement Batch'
+    __name__ = 'party.statement.batch'
+
+    _states = {
+        'readonly': Eval('state') != 'draft',
+        }
+
+    company = fields.Many2One('company.company', 'Company', required=True,
+        states=_states)
+    category = fields.Many2One('party.category', 'Category',
+        states=_states)
+    from_date = fields.Date('From Date', states=_states)
+    to_date = fields.Date('To Date', states=_states)
+    open_items = fields.Boolean('Open Items Only', states=_states)
+    with_balance = fields.Boolean('Only With Balance', states=_states,
+        help='Generate the statements only for the parties with a balance.')
+    report = fields.Selection([
+            ('account.move.line.move_line_list', 'Statement of Account'),
+            ('account.move.line.move_line_list_spreadsheet',
+                'Statement of Account Spreadsheet'),
+            ], 'Report', required=True, states=_states)
+    parties = fields.One2Many('party.statement.batch.party', 'batch',
+        'Parties', readonly=True)
+    progress = fields.Function(fields.Float('Progress', digits=(1, 2)),
+        'get_progress')
+    state = fields.Selection([
+            ('draft', 'Draft'),
+            ('processing', 'Processing'),
+            ('done', 'Done'),
+            ], 'State', readonly=True)
+
+    del _states
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls._order.insert(0, ('id', 'DESC'))
+        cls._transitions |= set((
+                ('draft', 'processing'),
+                ('processing', 'done'),
+                ))
+        cls._buttons.update({
+                'process': {
+                    'invisible': Eval('state') != 'draft',
+                    'depends': ['state'],
+                    },
+                'resume': {
+                    'invisible': Eval('state') != 'processing',
+                    'depends': ['state'],
+                    },
+                })
+
+    @staticmethod
+    def default_company():
+        return Transaction().context.get('company')
+
+    @staticmethod
+    def default_with_balance():
+        return True
+
+    @staticmethod
+    def default_report():
+        return 'account.move.line.move_line_list'
+
+    @staticmethod
+    def default_state():
+        return 'draft'
+
+    @classmethod
+    def get_progress(cls, batches, name):
+        pool = Pool()
+        BatchParty = pool.get('party.statement.batch.party')
+        batch_party = BatchParty.__table__()
+        cursor = Transaction().connection.cursor()
+
+        progress = dict((b.id, 0.) for b in batches)
+        for sub_ids in grouped_slice([b.id for b in batches]):
+            cursor.execute(*batch_party.select(
+                    batch_party.batch,
+                    Count(Literal('*')),
+                    Sum(Case((batch_party.state == 'done', 1), else_=0)),
+                    where=reduce_ids(batch_party.batch, sub_ids),
+                    group_by=batch_party.batch))
+            for batch_id, total, done in cursor:
+                progress[batch_id] = done / total
+        return progress
+
+    @classmethod
+    def copy(cls, batches, default=None):
+        if default is None:
+            default = {}
+        else:
+            default = default.copy()
+        default.setdefault('parties', None)
+        return super().copy(batches, default=default)
+
+    def get_parties(self):
+        'Return the ids of the parties to generate a statement for'
+        pool = Pool()
+        PartyBalance = pool.get('party.balance.account')
+        domain = []
+        if self.with_balance:
+            domain.append(('balance', '!=', 0))
+        with Transaction().set_context(
+                company=self.company.id,
+                category=self.category.id if self.category else None,
+                from_date=self.from_date,
+                to_date=self.to_date):
+            return [p.id for p in PartyBalance.search(domain, order=[])]
+
+    def get_statement_domain(self, party):
+        domain = [
+            ('move.company', '=', self.company.id),
+            ('party', '=', party.id),
+            ('payable_receivable', '=', True),
+            ]
+        if self.from_date:
+            domain.append(('date', '>=', self.from_date))
+        if self.to_date:
+            domain.append(('date', '<=', self.to_date))
+        if self.open_items:
+            domain.append(('reconciliation', '=', None))
+        return domain
+
+    def get_statement_context(self, party):
+        return {
+            'company': self.company.id,
+            'party': party.id,
+            'account_kind': ['payable', 'receivable'],
+            'from_date': self.from_date,
+            'to_date': self.to_date,
+            'open_items': self.open_items,
+            }
+
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('processing')
+    def process(cls, batches):
+        pool = Pool()
+        BatchParty = pool.get('party.statement.batch.party')
+        to_create = []
+        for batch in batches:
+            for party_id in batch.get_parties():
+                to_create.append({
+                        'batch': batch.id,
+                        'party': party_id,
+                        })
+        BatchParty.create(to_create)
+        cls.resume(batches)
+
+    @classmethod
+    @ModelView.button
+    def resume(cls, batches):
+        'Queue the statements of the parties not yet generated'
+        pool = Pool()
+        BatchParty = pool.get('party.statement.batch.party')
+        transaction = Transaction()
+        pending = BatchParty.search([
+                ('batch', 'in', [b.id for b in batches]),
+                ('state', '=', 'pending'),
+                ], order=[('batch', 'ASC'), ('id', 'ASC')])
+        if pending:
+            with transaction.set_context(queue_batch=transaction.context.get(
+                        'queue_batch', True)):
+                BatchParty.__queue__.generate(pending)
+        cls.check_done(batches)
+
+    @classmethod
+    def check_done(cls, batches):
+        'Mark as done the batches without pending statement'
+        pool = Pool()
+        BatchParty = pool.get('party.statement.batch.party')
+        # The checks of a batch wait for each other so the last one sees all
+        # the generated statements
+        cls.lock(batches)
+        pending = {p.batch.id for p in BatchParty.search([
+                    ('batch', 'in', [b.id for b in batches]),
+                    ('state', '=', 'pending'),
+                    ])}
+        cls.done([b for b in batches if b.id not in pending])
+
+    @classmethod
+    @Workflow.transition('done')
+    def done(cls, batches):
+        pass
+
+
+class StatementBatchParty(ModelSQL, ModelView):
+    'Statement Batch Party'
+    __name__ = 'party.statement.batch.party'
+    batch = fields.Many2One('party.statement.batch', 'Batch', required=True,
+        ondelete='CASCADE')
+    party = fields.Many2One('party.party', 'Party', required=True,
+        ondelete='CASCADE')
+    attachment = fields.Many2One('ir.attachment', 'Attachment',
+        readonly=True)
+    state = fields.Selection([
+            ('pending', 'Pending'),
+            ('done', 'Done'),
+            ], 'State', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        table = cls.__table__()
+        cls._sql_indexes.update({
+                Index(table,
+                    (table.batch, Index.Equality()),
+                    where=table.state == 'pending'),
+                })
+
+    @staticmethod
+    def default_state():
+        return 'pending'
+
+    @classmethod
+    def generate(cls, batch_parties):
+        'Render and attach the statement of each party'
+        pool = Pool()
+        Attachment = pool.get('ir.attachment')
+        Batch = pool.get('party.statement.batch')
+        Line = pool.get('account.move.line')
+
+        # Tasks queued again on resume skip the statements already done
+        cls.lock(batch_parties)
+        batch_parties = [p for p in cls.browse([p.id for p in batch_parties])
+            if p.state == 'pending']
+        for batch_party in batch_parties:
+            batch, party = batch_party.batch, batch_party.party
+            Report = pool.get(batch.report, type='report')
+            with Transaction().set_context(
+                    **batch.get_statement_context(party)):
+                lines = Line.search(batch.get_statement_domain(party),
+                    order=[('date', 'ASC'), ('move.number', 'ASC'),
+                        ('id', 'ASC')])
+                if lines:
+                    extension, content, _, name = Report.execute(
+                        [l.id for l in lines], {})
+                    attachment = Attachment(
+                        resource=party,
+                        name='%s - %s.%s' % (name, party.name, extension),
+                        data=content)
+                    attachment.save()
+                    batch_party.attachment = attachment
+            batch_party.state = 'done'
+        cls.save(batch_parties)
+        # The tasks running in parallel do not see the statements of the
+        # others so the batches are checked once this task is committed
+        Batch.__queue__.check_done(list({p.batch for p in batch_parties}))
+
+
+class CSVReportMixin:
+    '''
+    Report that writes the records as CSV rows
+
+    The rows are read in slices and written directly instead of rendering
+    a template. They are written to a temporary file which is kept in
+    memory up to _csv_max_size characters.
+    '''
+    __slots__ = ()
+    _csv_fields = []
+    _csv_max_size = 1024 * 1024
+
+    @classmethod
+    def _execute(cls, records, header, data, action):
+        Model = Pool().get(action.model or data.get('model'))
+        with tempfile.SpooledTemporaryFile(max_size=cls._csv_max_size,
+                mode='w+', newline='', encoding='utf-8') as file:
+            cls._write_csv(Model, [r.id for r in records], file)
+            file.seek(0)
+            return 'csv', file.read().encode('utf-8')
+
+    @classmethod
+    def _write_csv(cls, Model, ids, file):
+        definitions = Model.fields_get(cls._csv_fields)
+        read_names = []
+        for name in cls._csv_fields:
+            if definitions[name]['type'] == 'many2one':
+                read_names.append(name + '.rec_name')
+            else:
+                read_names.append(name)
+
+        writer = csv.writer(file)
+        writer.writerow([definitions[n]['string'] for n in cls._csv_fields])
+        for sub_ids in grouped_slice(ids):
+            sub_ids = list(sub_ids)
+            rows = {r['id']: r for r in Model.read(sub_ids, read_names)}
+            for id_ in sub_ids:
+                row = rows[id_]
+                writer.writerow([cls._format_csv_value(row, n, definitions[n])
+                        for n in cls._csv_fields])
+
+    @classmethod
+    def _format_csv_value(cls, row, name, definition):
+        if definition['type'] == 'many2one':
+            value = row.get(name + '.')
+            return value['rec_name'] if value else ''
+        value = row[name]
+        if value is None:
+            return ''
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        return str(value)
+
+
+StatementRow = namedtuple('StatementRow', [
+        'party_id', 'party', 'origin', 'description', 'date',
+        'maturity_date', 'debit', 'credit', 'balance', 'reconciliation'])
+
+
+class StatementReportMixin:
+    '''
+    Report that renders the lines from already formatted rows
+
+    The lines are read at once and the values are formatted with the
+    languages and the currency fetched once, so the template only iterates
+    over plain tuples.
+    '''
+    __slots__ = ()
+    _reconciliation = False
+
+    @classmethod
+    def get_context(cls, records, header, data):
+        context = super().get_context(records, header, data)
+        lines = cls._get_rows(records, context['user'], context['company'])
+        parties = {}
+        for line in lines:
+            parties.setdefault(line.party_id, []).append(line)
+        context['lines'] = lines
+        context['parties'] = [(l[0].party, l) for l in parties.values()]
+        context['party_name'] = (
+            lines[0].party if len(parties) == 1 else '')
+        return context
+
+    @classmethod
+    def _get_rows(cls, records, user, company):
+        pool = Pool()
+        Lang = pool.get('ir.lang')
+        if not records:
+            return []
+        Model = records[0].__class__
+
+        date_lang = user.language or Lang.get()
+        if company:
+            currency_lang = company.party.lang or Lang.get()
+            currency = company.currency
+        else:
+            currency_lang, currency = Lang.get(), None
+
+        def format_date(value):
+            return date_lang.strftime(value) if value else ''
+
+        def format_amount(value):
+            if value is None:
+                return ''
+            if currency is None:
+                return currency_lang.format_number(value)
+            return currency_lang.currency(value, currency, grouping=True)
+
+        names = ['party', 'party.rec_name', 'origin_text',
+            'move_description_used', 'date', 'maturity_date', 'debit',
+            'credit', 'balance']
+        if cls._reconciliation:
+            names.append('reconciliation.rec_name')
+        values = {}
+        for sub_records in grouped_slice(records):
+            for row in Model.read([r.id for r in sub_records], names):
+                values[row['id']] = row
+
+        rows = []
+        for record in records:
+            row = values[record.id]
+            party = row.get('party.')
+            reconciliation = row.get('reconciliation.')
+            rows.append(StatementRow(
+                    party_id=row['party'],
+                    party=party['rec_name'] if party else '',
+                    origin=row['origin_text'] or '',
+                    description=row['move_description_used'] or '',
+                    date=format_date(row['date']),
+                    maturity_date=format_date(row['maturity_date']),
+                    debit=format_amount(row['debit']),
+                    credit=format_amount(row['credit']),
+                    balance=format_amount(row['balance']),
+                    reconciliation=(
+                        reconciliation['rec_name'] if reconciliation else ''),
+                    ))
+        return rows
+
+
+class StatementOfAccountReport(StatementReportMixin, CompanyReport):
     'Statement of Account'
     __name__ = 'account.move.line.move_line_list'
+    _reconciliation = True
 
 
 class StatementOfAccountSpreadsheet(CompanyReport):
@@ -740,7 +2703,7 @@ class PartyBalanceAccountReport(Report):
     __name__ = 'party.balance.account.report'
 
 
-class PartyBalanceLineReport(CompanyReport):
+class PartyBalanceLineReport(StatementReportMixin, CompanyReport):
     'Party Balance Line Report'
     __name__ = 'party.balance.line.report'
 
@@ -748,3 +2711,24 @@ class PartyBalanceLineReport(CompanyReport):
 class PartyBalanceLineSpreadsheet(CompanyReport):
     'Party Balance Line Spreadsheet'
     __name__ = 'party.balance.line.spreadsheet'
+
+
+class StatementOfAccountCSV(CSVReportMixin, Report):
+    'Statement of Account CSV'
+    __name__ = 'account.move.line.move_line_list_csv'
+    _csv_fields = ['origin_text', 'move', 'move_description_used', 'date',
+        'maturity_date', 'debit', 'credit', 'balance', 'reconciliation']
+
+
+class PartyBalanceAccountCSV(CSVReportMixin, Report):
+    'Party Balance Account CSV'
+    __name__ = 'party.balance.account.csv'
+    _csv_fields = ['code', 'name', 'tax_identifier', 'debit', 'credit',
+        'balance']
+
+
+class PartyBalanceLineCSV(CSVReportMixin, Report):
+    'Party Balance Line CSV'
+    __name__ = 'party.balance.line.csv'
+    _csv_fields = ['origin_text', 'move', 'move_description_used', 'date',
+        'maturity_date', 'debit', 'credit', 'balance']